@@ -1,13 +1,35 @@
+import click
 from flask import Flask
 from flask_cors import CORS
+from db import connection
+from db.create import rebuild_category_spending, rebuild_daily_balances
+from db.missions import evaluate_missions, generate_weekly_missions
+from db.reconcile import balance_drift, ledger_watermark, reconcile_balances
 from routes.accounts import accounts_bp
 from routes.transactions import transactions_bp
 from routes.goals import goals_bp
+from routes.goal_transactions import goal_transactions_bp
 from routes.missions import missions_bp
 from routes.forecast import forecast_bp
+from routes import metrics
 
 app = Flask(__name__)
 app.config['DATABASE'] = 'db/goalflow.db'
+app.config['DB_POOL_SIZE'] = 8
+app.config['SLOW_QUERY_MS'] = None  # log statements slower than this (ms)
+app.config['FORECAST_MODEL_WORKERS'] = 1  # processes fitting forecast models
+app.config['FORECAST_MODEL_WAIT'] = 5  # seconds a request waits for a fit
+app.config['WRITE_QUEUE'] = False  # hand writes to one group-committing writer thread
+app.config['WRITE_BATCH_SIZE'] = 256  # writes committed together at most
+app.config['MAX_EVENT_STREAMS'] = 1000  # open event streams per process, each holding a thread
+# Overrides from the environment, e.g. FLASK_SLOW_QUERY_MS=50
+app.config.from_prefixed_env()
+
+# Pooled SQLite connections, handed to the blueprints through `g`
+connection.init_app(app)
+
+# Per-request latency and SQL metrics, served at /metrics
+metrics.init_app(app)
 
 # Enable CORS for frontend (replace URL later if needed)
 CORS(app, resources={r"/*": {"origins": "*"}})
@@ -16,9 +38,51 @@ CORS(app, resources={r"/*": {"origins": "*"}})
 app.register_blueprint(accounts_bp, url_prefix='/accounts')
 app.register_blueprint(transactions_bp, url_prefix='/transactions')
 app.register_blueprint(goals_bp, url_prefix='/goals')
+app.register_blueprint(goal_transactions_bp, url_prefix='/goal-transactions')
 app.register_blueprint(missions_bp, url_prefix='/missions')
 app.register_blueprint(forecast_bp, url_prefix="/forecast")
 
+@app.cli.command("rebuild-rollups")
+def rebuild_rollups():
+    """Rebuilds the rollup tables from the Transactions ledger."""
+    conn = connection.get_db()
+    with connection.transaction(conn):
+        rebuild_daily_balances(conn)
+        rebuild_category_spending(conn)
+    print("Rollups rebuilt")
+
+@app.cli.command("reconcile")
+@click.option("--since", type=int, help="Only check accounts with a transaction id above this watermark.")
+@click.option("--apply", is_flag=True, help="Set drifting balances to the ledger balance.")
+def reconcile(since, apply):
+    """Compares stored account balances with the Transactions ledger."""
+    conn = connection.get_db()
+    with connection.transaction(conn):
+        watermark = ledger_watermark(conn)
+        drift = reconcile_balances(conn, since) if apply else balance_drift(conn, since)
+    for row in drift:
+        print(f"account {row['account_id']}: stored {row['stored_balance']}, ledger {row['ledger_balance']}, drift {row['drift']}")
+    print(f"{len(drift)} account(s) {'fixed' if apply else 'drifting'}; watermark {watermark}")
+
+@app.cli.command("evaluate-missions")
+@click.option("--full", is_flag=True, help="Check every open mission, not only those affected since the last run.")
+def evaluate_missions_command(full):
+    """Completes the open weekly missions whose goal is met."""
+    conn = connection.get_db()
+    with connection.transaction(conn):
+        completed = evaluate_missions(conn, full=full)
+    for mission_type, count in completed.items():
+        print(f"{mission_type}: {count} completed")
+
+@app.cli.command("generate-missions")
+@click.option("--week", type=click.DateTime(["%Y-%m-%d"]), help="Any day of the week to generate (default: this week).")
+def generate_missions_command(week):
+    """Creates the week's missions from MissionTemplates for every open goal."""
+    conn = connection.get_db()
+    with connection.transaction(conn):
+        start, created = generate_weekly_missions(conn, week.date() if week else None)
+    print(f"{created} mission(s) created for the week of {start}")
+
 if __name__ == "__main__":
     # Use 0.0.0.0 so AWS or Docker can access it
     app.run(host='0.0.0.0', port=5000, debug=True)
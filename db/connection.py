@@ -0,0 +1,306 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager, suppress
+
+from flask import current_app, g
+
+from db.create import migrate_db
+
+# ------------------------------------------------------
+# Shared SQLite access layer for the blueprints
+# ------------------------------------------------------
+#
+# Each worker process keeps a small pool of open connections per database
+# file. A request borrows one through `get_db()` (cached on `g`) and hands it
+# back on app-context teardown, so connection setup and pragmas are paid once
+# per connection instead of once per request.
+
+# Applied once to every connection when it is opened
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL;",
+    "PRAGMA synchronous = FULL;",       # one WAL fsync per commit, so commits survive power loss
+    "PRAGMA cache_size = -16000;",      # ~16 MB page cache
+    "PRAGMA mmap_size = 268435456;",    # 256 MB memory-mapped reads
+    "PRAGMA foreign_keys = ON;",
+)
+
+# Prepared statements kept per connection (sqlite3 default is 128)
+STATEMENT_CACHE_SIZE = 256
+
+# Idle connections kept per database file and worker process
+POOL_SIZE = 8
+
+
+# Called as observer(sql, seconds) after every statement, see set_statement_observer()
+_statement_observer = None
+
+# The writer thread collects the statements of each write here instead, for
+# the submitting request to report (see run_write())
+_collected = threading.local()
+
+
+def set_statement_observer(observer):
+    """Installs a callback timing every statement run on pooled connections (None removes it)."""
+    global _statement_observer
+    _statement_observer = observer
+
+
+def _observe(sql, seconds):
+    statements = getattr(_collected, "statements", None)
+    if statements is not None:
+        statements.append((sql, seconds))
+    else:
+        _statement_observer(sql, seconds)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    Reports execute() / executemany() calls and their duration to the
+    statement observer. Rows fetched later from the returned cursor (e.g.
+    streamed responses) are not included in the time.
+    """
+
+    def execute(self, sql, parameters=()):
+        if _statement_observer is None:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _observe(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, parameters):
+        if _statement_observer is None:
+            return super().executemany(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            _observe(sql, time.perf_counter() - start)
+
+
+def connect(path):
+    conn = sqlite3.connect(
+        path,
+        timeout=10,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        factory=InstrumentedConnection,
+    )
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return connect(self.path)
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+_pools = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+
+def get_pool(path, size=POOL_SIZE):
+    global _pools, _pools_pid
+    with _pools_lock:
+        # Connections must not be shared across a fork (e.g. gunicorn workers)
+        if _pools_pid != os.getpid():
+            _pools = {}
+            _pools_pid = os.getpid()
+        pool = _pools.get(path)
+        if pool is None:
+            pool = ConnectionPool(path, size)
+            # First use of this database in the process: bring the schema up to date
+            conn = pool.acquire()
+            migrate_db(conn)
+            pool.release(conn)
+            _pools[path] = pool
+        return pool
+
+
+def get_db():
+    """Return the connection bound to the current app context."""
+    if "db" not in g:
+        pool = get_pool(
+            current_app.config["DATABASE"],
+            current_app.config.get("DB_POOL_SIZE", POOL_SIZE),
+        )
+        g.db_pool = pool
+        g.db = pool.acquire()
+    return g.db
+
+
+def release_db(exc=None):
+    conn = g.pop("db", None)
+    pool = g.pop("db_pool", None)
+    if conn is not None:
+        pool.release(conn)
+
+
+@contextmanager
+def transaction(conn):
+    """
+    Runs the block as one BEGIN IMMEDIATE transaction: the write lock is taken
+    up front (no lock upgrade deadlocks between readers turned writers) and
+    everything inside commits with a single fsync, or rolls back on error.
+    """
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+# ------------------------------------------------------
+# Optional single-writer queue (WRITE_QUEUE)
+# ------------------------------------------------------
+#
+# By default every request takes the SQLite write lock itself, so concurrent
+# writers queue up inside SQLite's busy timeout. With WRITE_QUEUE on, a
+# request hands its write to one writer thread per database file and
+# process instead. The writer runs every write waiting in its queue inside
+# one BEGIN IMMEDIATE transaction, each under its own SAVEPOINT so that a
+# failing write only undoes itself, and commits the group together: one
+# lock acquisition and one WAL append for the lot. Each request blocks on a
+# future that is resolved only after the commit, so no response reports a
+# write that has not been committed. The statements of each write, plus the
+# group's BEGIN and COMMIT it waited for, are timed on the writer thread and
+# reported to the statement observer from the request once it resumes.
+
+# Writes committed together at most
+WRITE_BATCH_SIZE = 256
+
+
+class Writer:
+    def __init__(self, path, batch_size=WRITE_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._conn = connect(path)
+        threading.Thread(target=self._run, name="sqlite-writer", daemon=True).start()
+
+    def submit(self, fn):
+        """
+        Queues fn(conn); the returned future holds its result once committed,
+        and its `statements` the (sql, seconds) pairs run for it.
+        """
+        future = Future()
+        future.statements = []
+        self._queue.put((fn, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch):
+        conn = self._conn
+        outcomes = []  # (result, exception) per write
+        shared = []  # statements of the whole group
+        try:
+            _collected.statements = shared
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, future in batch:
+                _collected.statements = future.statements
+                conn.execute("SAVEPOINT write")
+                try:
+                    outcomes.append((fn(conn), None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write")
+                    outcomes.append((None, e))
+                conn.execute("RELEASE write")
+            _collected.statements = shared
+            start = time.perf_counter()
+            conn.commit()
+            shared.append(("COMMIT", time.perf_counter() - start))
+        except Exception as e:
+            # Nothing in the group was committed
+            with suppress(sqlite3.Error):
+                conn.rollback()
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        finally:
+            _collected.statements = None
+        for (_, future), (result, error) in zip(batch, outcomes):
+            future.statements.extend(shared)
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+_writers = {}
+_writers_pid = None
+_writers_lock = threading.Lock()
+
+
+def get_writer(path):
+    global _writers, _writers_pid
+    with _writers_lock:
+        # The writer thread does not survive a fork
+        if _writers_pid != os.getpid():
+            _writers = {}
+            _writers_pid = os.getpid()
+        writer = _writers.get(path)
+        if writer is None:
+            get_pool(path, current_app.config.get("DB_POOL_SIZE", POOL_SIZE))  # migrates the schema on first use
+            writer = _writers[path] = Writer(path, current_app.config.get("WRITE_BATCH_SIZE", WRITE_BATCH_SIZE))
+        return writer
+
+
+def run_write(fn):
+    """
+    Runs fn(conn) as a write transaction and returns its result, or raises
+    its exception. With WRITE_QUEUE it runs on the writer thread, grouped
+    with other requests' writes, so `fn` must only use the connection it is
+    given (no `request` or `g`); otherwise it runs right away on the
+    request's connection.
+    """
+    if current_app.config.get("WRITE_QUEUE"):
+        future = get_writer(current_app.config["DATABASE"]).submit(fn)
+        try:
+            return future.result()
+        finally:
+            if _statement_observer is not None:
+                for sql, seconds in future.statements:
+                    _statement_observer(sql, seconds)
+    conn = get_db()
+    with transaction(conn):
+        return fn(conn)
+
+
+def init_app(app):
+    app.teardown_appcontext(release_db)
@@ -1,11 +1,320 @@
 import sqlite3
 
+# ------------------------------------------------------
+# Rollup backfills
+# ------------------------------------------------------
+# Rollup tables are maintained incrementally by the API write paths
+# (db/rollups.py); these rebuild them from the Transactions ledger.
+
+def rebuild_daily_balances(conn):
+    """
+    Recomputes AccountDailyBalances: one row per account and day with
+    activity, where closing_balance is the current Accounts.balance minus
+    the net flow of every later day.
+    """
+    conn.execute("DELETE FROM AccountDailyBalances")
+    conn.execute("""
+        INSERT INTO AccountDailyBalances (account_id, date, inflow, outflow, closing_balance)
+        SELECT d.account_id, d.day, d.inflow, d.outflow,
+               a.balance - IFNULL(SUM(d.inflow - d.outflow) OVER (
+                   PARTITION BY d.account_id ORDER BY d.day DESC
+                   ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+               ), 0)
+        FROM (
+            SELECT account_id, date(datetime) AS day, SUM(inflow) AS inflow, SUM(outflow) AS outflow
+            FROM (
+                SELECT destination_account AS account_id, datetime, amount AS inflow, 0 AS outflow
+                FROM Transactions WHERE destination_account IS NOT NULL
+                UNION ALL
+                SELECT origin_account, datetime, 0, amount
+                FROM Transactions WHERE origin_account IS NOT NULL
+            )
+            GROUP BY account_id, day
+        ) d
+        JOIN Accounts a ON a.id = d.account_id
+    """)
+
+# First day of the period containing `when`, per AccountCategorySpending grain
+SPENDING_PERIODS = {
+    "month": "date({when}, 'start of month')",
+    "week": "date({when}, 'weekday 0', '-6 days')",  # Monday
+}
+
+def rebuild_category_spending(conn):
+    """
+    Recomputes AccountCategorySpending: money leaving each account per
+    category (business_type), summed per month and per week. Bumps every
+    account's change counter, which the spending ETags are derived from.
+    """
+    conn.execute("DELETE FROM AccountCategorySpending")
+    for grain, period in SPENDING_PERIODS.items():
+        conn.execute(f"""
+            INSERT INTO AccountCategorySpending (account_id, grain, period, category, amount, transactions)
+            SELECT origin_account, '{grain}', {period.format(when="datetime")}, IFNULL(business_type, 'UNCATEGORIZED'),
+                   SUM(amount), COUNT(*)
+            FROM Transactions
+            WHERE origin_account IS NOT NULL
+            GROUP BY 1, 3, 4
+        """)
+    # The table is rewritten without touching Accounts, so no trigger does it
+    conn.execute("""
+        INSERT INTO ChangeCounters (scope, version)
+        SELECT 'Accounts:' || id, 1 FROM Accounts
+        WHERE true
+        ON CONFLICT (scope) DO UPDATE SET version = version + 1
+    """)
+
+# Descriptions of the GoalTransactions rows that book an amount set by hand
+# (routes/goal_transactions.py record_adjustment) rather than a contribution
+OPENING_AMOUNT = "Opening amount"
+MANUAL_ADJUSTMENT = "Manual adjustment"
+ADJUSTMENTS = (OPENING_AMOUNT, MANUAL_ADJUSTMENT)
+
+# Whether a GoalTransactions row is a contribution: money put in, not a withdrawal or an adjustment
+def _is_contribution(row):
+    adjustments = ", ".join(f"'{d}'" for d in ADJUSTMENTS)
+    return f"({row}.Type IS NOT 'OUT' AND IFNULL({row}.Description, '') NOT IN ({adjustments}))"
+
+def rebuild_goal_progress(conn):
+    """
+    Recomputes CurrentAmount, ContributionCount and LastContributionAt of
+    every goal from its GoalTransactions ('OUT' rows are withdrawals, and
+    adjustments move the amount without being contributions).
+    """
+    conn.execute("UPDATE Goals SET CurrentAmount = 0.0, ContributionCount = 0, LastContributionAt = NULL")
+    conn.execute(f"""
+        UPDATE Goals
+        SET CurrentAmount = ROUND(l.amount, 2), ContributionCount = l.contributions, LastContributionAt = l.last
+        FROM (
+            SELECT GoalId,
+                   SUM(CASE Type WHEN 'OUT' THEN -Amount ELSE Amount END) AS amount,
+                   SUM({_is_contribution("t")}) AS contributions,
+                   MAX(CASE WHEN {_is_contribution("t")} THEN CreatedAt END) AS last
+            FROM GoalTransactions t GROUP BY GoalId
+        ) AS l
+        WHERE Goals.GoalId = l.GoalId
+    """)
+
+# Signed effect of a GoalTransactions row on its goal's CurrentAmount
+def _goal_flow(row):
+    return f"(CASE {row}.Type WHEN 'OUT' THEN -{row}.Amount ELSE {row}.Amount END)"
+
+# ------------------------------------------------------
+# Schema migrations
+# Keep each goal's progress columns in step with its GoalTransactions rows
+GOAL_PROGRESS_TRIGGERS = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_goal_transactions_insert_progress
+    AFTER INSERT ON GoalTransactions BEGIN
+        UPDATE Goals SET
+            CurrentAmount = ROUND(IFNULL(CurrentAmount, 0) + {_goal_flow("NEW")}, 2),
+            ContributionCount = ContributionCount + {_is_contribution("NEW")},
+            LastContributionAt = CASE
+                WHEN {_is_contribution("NEW")} AND (LastContributionAt IS NULL OR NEW.CreatedAt > LastContributionAt)
+                THEN NEW.CreatedAt ELSE LastContributionAt END
+        WHERE GoalId = NEW.GoalId;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_goal_transactions_delete_progress
+    AFTER DELETE ON GoalTransactions BEGIN
+        UPDATE Goals SET
+            CurrentAmount = ROUND(IFNULL(CurrentAmount, 0) - {_goal_flow("OLD")}, 2),
+            ContributionCount = ContributionCount - {_is_contribution("OLD")},
+            LastContributionAt = (
+                SELECT MAX(CreatedAt) FROM GoalTransactions t
+                WHERE t.GoalId = OLD.GoalId AND {_is_contribution("t")}
+            )
+        WHERE GoalId = OLD.GoalId;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_goal_transactions_update_progress
+    AFTER UPDATE OF GoalId, Type, Amount, Description, CreatedAt ON GoalTransactions BEGIN
+        UPDATE Goals SET
+            CurrentAmount = ROUND(IFNULL(CurrentAmount, 0) - {_goal_flow("OLD")}, 2),
+            ContributionCount = ContributionCount - {_is_contribution("OLD")}
+        WHERE GoalId = OLD.GoalId;
+        UPDATE Goals SET
+            CurrentAmount = ROUND(IFNULL(CurrentAmount, 0) + {_goal_flow("NEW")}, 2),
+            ContributionCount = ContributionCount + {_is_contribution("NEW")}
+        WHERE GoalId = NEW.GoalId;
+        UPDATE Goals SET LastContributionAt = (
+            SELECT MAX(CreatedAt) FROM GoalTransactions t
+            WHERE t.GoalId = Goals.GoalId AND {_is_contribution("t")}
+        )
+        WHERE GoalId IN (OLD.GoalId, NEW.GoalId);
+    END
+    """,
+)
+
+# ------------------------------------------------------
+# MIGRATIONS[n - 1] upgrades a database from version n - 1 to n, where the
+# version is stored in PRAGMA user_version. Each migration is a tuple of
+# single SQL statements (or callables taking the connection), applied in one
+# transaction, so existing databases upgrade in place.
+
+MIGRATIONS = [
+    # 1: per-account transaction history and per-user goal lookups
+    (
+        "CREATE INDEX IF NOT EXISTS idx_transactions_origin_datetime ON Transactions (origin_account, datetime)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_destination_datetime ON Transactions (destination_account, datetime)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_datetime ON Transactions (datetime)",
+        "CREATE INDEX IF NOT EXISTS idx_goals_user ON Goals (UserId)",
+    ),
+    # 2: weekly mission lookups by user (bounded by deadline) and by goal
+    (
+        "CREATE INDEX IF NOT EXISTS idx_missions_user_deadline ON WeeklyMissions (UserId, Deadline)",
+        "CREATE INDEX IF NOT EXISTS idx_missions_goal ON WeeklyMissions (GoalId)",
+    ),
+    # 3: daily per-account inflow / outflow / closing balance rollup
+    (
+        """
+        CREATE TABLE IF NOT EXISTS AccountDailyBalances (
+            account_id INTEGER NOT NULL REFERENCES Accounts(id) ON DELETE CASCADE,
+            date TEXT NOT NULL,
+            inflow REAL NOT NULL DEFAULT 0.0,
+            outflow REAL NOT NULL DEFAULT 0.0,
+            closing_balance REAL NOT NULL DEFAULT 0.0,
+            PRIMARY KEY (account_id, date)
+        ) WITHOUT ROWID
+        """,
+        rebuild_daily_balances,
+    ),
+    # 4: change counters behind the ETags of the polled list endpoints
+    (
+        """
+        CREATE TABLE IF NOT EXISTS ChangeCounters (
+            scope TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        """,
+        # Random per database file, so versions of a recreated file never
+        # collide with ETags handed out for the old one
+        "INSERT OR IGNORE INTO ChangeCounters (scope, version) VALUES ('epoch', abs(random()))",
+        *[
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table.lower()}_{event.lower()}_version
+            AFTER {event} ON {table} BEGIN
+                INSERT INTO ChangeCounters (scope, version) VALUES {scopes}
+                ON CONFLICT (scope) DO UPDATE SET version = version + 1;
+            END
+            """
+            for table, key in (("Accounts", "id"), ("Goals", "UserId"), ("WeeklyMissions", "UserId"))
+            for event, scopes in (
+                ("INSERT", f"('{table}', 1), ('{table}:' || NEW.{key}, 1)"),
+                ("UPDATE", f"('{table}', 1), ('{table}:' || OLD.{key}, 1), ('{table}:' || NEW.{key}, 1)"),
+                ("DELETE", f"('{table}', 1), ('{table}:' || OLD.{key}, 1)"),
+            )
+        ],
+    ),
+    # 5: goal progress kept in step with the GoalTransactions ledger
+    (
+        "ALTER TABLE Goals ADD COLUMN ContributionCount INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE Goals ADD COLUMN LastContributionAt TEXT",
+        "CREATE INDEX IF NOT EXISTS idx_goal_transactions_goal ON GoalTransactions (GoalId, CreatedAt)",
+        # Amounts set by hand so far become an opening ledger entry, so the
+        # rebuild below keeps every goal's CurrentAmount
+        """
+        INSERT INTO GoalTransactions (GoalId, UserId, Type, Amount, Description, CreatedAt)
+        SELECT g.GoalId, g.UserId, CASE WHEN g.diff > 0 THEN 'IN' ELSE 'OUT' END, abs(g.diff),
+               'Opening amount', IFNULL(g.CreatedAt, datetime('now'))
+        FROM (
+            SELECT GoalId, UserId, CreatedAt, ROUND(IFNULL(CurrentAmount, 0) - IFNULL((
+                SELECT SUM(CASE Type WHEN 'OUT' THEN -Amount ELSE Amount END)
+                FROM GoalTransactions t WHERE t.GoalId = Goals.GoalId
+            ), 0), 2) AS diff
+            FROM Goals
+        ) AS g
+        WHERE g.diff <> 0
+        """,
+        rebuild_goal_progress,
+        *GOAL_PROGRESS_TRIGGERS,
+    ),
+    # 6: batch mission evaluation (db/missions.py)
+    (
+        "CREATE INDEX IF NOT EXISTS idx_missions_open ON WeeklyMissions (Type, MissionId) WHERE IsCompleted = 0",
+        # Progress markers of incremental jobs, by name
+        """
+        CREATE TABLE IF NOT EXISTS Watermarks (
+            name TEXT PRIMARY KEY,
+            value NOT NULL
+        ) WITHOUT ROWID
+        """,
+    ),
+    # 7: weekly missions generated from templates, at most one per goal and week
+    (
+        "ALTER TABLE WeeklyMissions ADD COLUMN Week TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_missions_goal_week ON WeeklyMissions (GoalId, Week) WHERE Week IS NOT NULL",
+    ),
+    # 8: per-account spending by category, per month and per week
+    (
+        """
+        CREATE TABLE IF NOT EXISTS AccountCategorySpending (
+            account_id INTEGER NOT NULL REFERENCES Accounts(id) ON DELETE CASCADE,
+            grain TEXT NOT NULL,
+            period TEXT NOT NULL,
+            category TEXT NOT NULL,
+            amount REAL NOT NULL DEFAULT 0.0,
+            transactions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (account_id, grain, period, category)
+        ) WITHOUT ROWID
+        """,
+        rebuild_category_spending,
+    ),
+    # 9: the balance an account was opened with, the start of its ledger.
+    # Existing accounts start at 0, so drift from before the upgrade still
+    # shows up in the first reconcile instead of being taken as opening.
+    (
+        "ALTER TABLE Accounts ADD COLUMN opening_balance REAL NOT NULL DEFAULT 0.0",
+    ),
+    # 10: adjustments booked on a goal are not contributions
+    (
+        "DROP TRIGGER IF EXISTS trg_goal_transactions_insert_progress",
+        "DROP TRIGGER IF EXISTS trg_goal_transactions_delete_progress",
+        "DROP TRIGGER IF EXISTS trg_goal_transactions_update_progress",
+        *GOAL_PROGRESS_TRIGGERS,
+        rebuild_goal_progress,
+    ),
+]
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate_db(conn):
+    """
+    Applies every pending migration and returns the resulting version.
+    Safe to run concurrently: the version is re-checked under the write lock.
+    """
+    if schema_version(conn) >= len(MIGRATIONS):
+        return schema_version(conn)
+
+    if conn.in_transaction:
+        conn.commit()
+    for version, steps in enumerate(MIGRATIONS, start=1):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if schema_version(conn) < version:
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return schema_version(conn)
+
 # ------------------------------------------------------
 # Database initialization for GoalFlow
 # ------------------------------------------------------
 
-def create_db():
-    conn = sqlite3.connect("db/goalflow.db")
+DB_PATH = "db/goalflow.db"
+
+def create_db(db_path=DB_PATH):
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
 
     # Enable foreign key constraints (disabled by default in SQLite)
@@ -124,8 +433,9 @@ def create_db():
     """)
 
     conn.commit()
+    version = migrate_db(conn)
     conn.close()
-    print("Database initialized successfully (goalflow.db)")
+    print(f"Database initialized successfully ({db_path}, schema version {version})")
 
 if __name__ == "__main__":
     create_db()
@@ -0,0 +1,213 @@
+from datetime import date, timedelta
+
+# ------------------------------------------------------
+# Weekly mission evaluation
+# ------------------------------------------------------
+#
+# Open missions are scored against the ledgers with one UPDATE per mission
+# type. Each mission is checked over its own window, from the day it was
+# created through its Deadline day, with range aggregates on the
+# (account, datetime) and (goal, date) indexes:
+#
+#   SAVE            net goal contributions (IN - OUT) reach TargetAmount
+#   TRANSFER        money sent to other accounts reaches TargetAmount
+#   STREAK          contributions to the goal on TargetAmount days in a row
+#   LIMIT_SPENDING  spending stays within TargetAmount; decided once the
+#                   Deadline day is over
+#
+# INSIGHT missions have nothing to measure and are left to the client.
+#
+# Incremental runs only look at missions that something could have changed
+# since the last run: new missions, missions of accounts / goals with new
+# ledger rows, and spending limits whose deadline passed in between. Edits
+# and deletions of older ledger rows are picked up by a full run.
+
+WATERMARKS = ("missions.transactions", "missions.goal_transactions", "missions.missions", "missions.evaluated_at")
+
+# Missions worth re-checking in an incremental run
+CANDIDATES_SQL = """
+    m.MissionId > :missions_since
+    OR m.UserId IN (
+        SELECT origin_account FROM Transactions WHERE id > :transactions_since
+        UNION
+        SELECT destination_account FROM Transactions WHERE id > :transactions_since
+    )
+    OR m.GoalId IN (SELECT GoalId FROM GoalTransactions WHERE TransactionId > :goal_transactions_since)
+    OR (m.Type = 'LIMIT_SPENDING' AND date(m.Deadline) >= date(:evaluated_at) AND date(m.Deadline) < date(:now))
+"""
+
+# The unary + on destination_account keeps the planner on the
+# (origin_account, datetime) index: "destination IS NULL" matches most rows.
+
+def in_window(column):
+    """`column` falls between mission m's first day and the end of its Deadline day."""
+    return f"{column} >= date(m.CreatedAt) AND {column} < date(m.Deadline, '+1 day')"
+
+# Per type: the condition under which an open mission `m` is completed
+COMPLETION_RULES = {
+    "SAVE": f"""
+        (SELECT IFNULL(SUM(CASE t.Type WHEN 'OUT' THEN -t.Amount ELSE t.Amount END), 0)
+         FROM GoalTransactions t
+         WHERE t.GoalId = m.GoalId AND {in_window('t.CreatedAt')}) >= m.TargetAmount
+    """,
+    "TRANSFER": f"""
+        (SELECT IFNULL(SUM(t.amount), 0)
+         FROM Transactions t
+         WHERE t.origin_account = m.UserId AND +t.destination_account IS NOT NULL
+           AND {in_window('t.datetime')}) >= m.TargetAmount
+    """,
+    # Gaps and islands: consecutive days share julianday(day) - row number
+    "STREAK": f"""
+        (SELECT IFNULL(MAX(days), 0) FROM (
+            SELECT COUNT(*) AS days FROM (
+                SELECT julianday(day) - ROW_NUMBER() OVER (ORDER BY day) AS island
+                FROM (
+                    SELECT DISTINCT date(t.CreatedAt) AS day
+                    FROM GoalTransactions t
+                    WHERE t.GoalId = m.GoalId AND t.Type IS NOT 'OUT' AND {in_window('t.CreatedAt')}
+                )
+            )
+            GROUP BY island
+        )) >= m.TargetAmount
+    """,
+    "LIMIT_SPENDING": f"""
+        date(m.Deadline) < date(:now)
+        AND (SELECT IFNULL(SUM(t.amount), 0)
+             FROM Transactions t
+             WHERE t.origin_account = m.UserId AND +t.destination_account IS NULL
+               AND {in_window('t.datetime')}) <= m.TargetAmount
+    """,
+}
+
+def read_watermarks(conn):
+    stored = dict(conn.execute(
+        f"SELECT name, value FROM Watermarks WHERE name IN ({', '.join('?' * len(WATERMARKS))})", WATERMARKS
+    ).fetchall())
+    return {
+        "transactions_since": stored.get("missions.transactions", 0),
+        "goal_transactions_since": stored.get("missions.goal_transactions", 0),
+        "missions_since": stored.get("missions.missions", 0),
+        "evaluated_at": stored.get("missions.evaluated_at", "0001-01-01 00:00:00"),
+    }
+
+def evaluate_missions(conn, full=False, now=None, completions=None):
+    """
+    Marks every open mission whose condition is met as completed, inside
+    the caller's transaction. Incremental unless `full`; either way the
+    watermarks are advanced. Returns the number completed per type; given a
+    `completions` list, also appends each completed (MissionId, UserId).
+    """
+    if now is None:
+        now = conn.execute("SELECT datetime('now')").fetchone()[0]
+    # Read before evaluating: rows landing meanwhile are seen next time
+    high = conn.execute("""
+        SELECT (SELECT IFNULL(MAX(id), 0) FROM Transactions),
+               (SELECT IFNULL(MAX(TransactionId), 0) FROM GoalTransactions),
+               (SELECT IFNULL(MAX(MissionId), 0) FROM WeeklyMissions)
+    """).fetchone()
+    params = {"now": now, **read_watermarks(conn)}
+    scope = "" if full else f"AND ({CANDIDATES_SQL})"
+    returning = "RETURNING MissionId, UserId" if completions is not None else ""
+
+    completed = {}
+    for mission_type, rule in COMPLETION_RULES.items():
+        cur = conn.execute(f"""
+            UPDATE WeeklyMissions SET IsCompleted = 1, CompletedAt = :now
+            WHERE MissionId IN (
+                SELECT m.MissionId FROM WeeklyMissions m
+                WHERE m.IsCompleted = 0 AND m.Type = '{mission_type}'
+                  AND date(m.CreatedAt) <= date(:now) {scope}
+                  AND {rule}
+            )
+            {returning}
+        """, params)
+        if completions is None:
+            completed[mission_type] = cur.rowcount
+        else:
+            rows = cur.fetchall()
+            completions.extend(rows)
+            completed[mission_type] = len(rows)
+
+    conn.executemany(
+        "INSERT INTO Watermarks (name, value) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = excluded.value",
+        zip(WATERMARKS, (*high, now))
+    )
+    return completed
+
+# ------------------------------------------------------
+# Weekly mission generation
+# ------------------------------------------------------
+#
+# Every open goal gets one mission per week, built from a MissionTemplates
+# row. Users are tiered by their average weekly outflow over the previous
+# four weeks (from the AccountDailyBalances rollup) relative to everyone
+# else's: lighter spenders get easier templates and smaller targets. Within
+# a difficulty level, templates rotate from week to week. All missions of a
+# week are inserted by one statement; the unique (GoalId, Week) index makes
+# reruns skip the goals that already have theirs.
+
+SPENDING_WEEKS = 4
+
+GENERATE_SQL = f"""
+    INSERT INTO WeeklyMissions (UserId, GoalId, TemplateId, Title, Description, Type, TargetAmount, CreatedAt, Deadline, Week)
+    WITH spend AS (
+        SELECT account_id, SUM(outflow) / {SPENDING_WEEKS}.0 AS weekly
+        FROM AccountDailyBalances
+        WHERE date >= date(:week, '-{SPENDING_WEEKS * 7} days') AND date < :week
+        GROUP BY account_id
+    ), average AS (
+        SELECT AVG(weekly) AS weekly FROM spend WHERE weekly > 0
+    ), open_goals AS (
+        SELECT g.GoalId, g.UserId, g.TargetAmount - IFNULL(g.CurrentAmount, 0) AS remaining,
+               IFNULL(s.weekly, 0) AS weekly,
+               MIN(2.0, MAX(0.5, IFNULL(s.weekly / NULLIF(a.weekly, 0), 1.0))) AS scale
+        FROM Goals g
+        LEFT JOIN spend s ON s.account_id = g.UserId
+        CROSS JOIN average a
+        WHERE IFNULL(g.CurrentAmount, 0) < g.TargetAmount
+          AND (g.Deadline IS NULL OR date(g.Deadline) >= :week)
+          AND NOT EXISTS (SELECT 1 FROM WeeklyMissions w WHERE w.GoalId = g.GoalId AND w.Week = :week)
+    ), tiers (tier) AS (
+        VALUES (1), (2), (3)
+    ), levels AS (
+        -- The closest difficulty that has templates, for each tier
+        SELECT tier, level FROM (
+            SELECT tier, DifficultyLevel AS level,
+                   ROW_NUMBER() OVER (PARTITION BY tier ORDER BY abs(DifficultyLevel - tier), DifficultyLevel) AS rank
+            FROM tiers CROSS JOIN (SELECT DISTINCT DifficultyLevel FROM MissionTemplates)
+        )
+        WHERE rank = 1
+    ), templates AS (
+        SELECT *, ROW_NUMBER() OVER (PARTITION BY DifficultyLevel ORDER BY TemplateId) - 1 AS position,
+               COUNT(*) OVER (PARTITION BY DifficultyLevel) AS siblings
+        FROM MissionTemplates
+    )
+    SELECT g.UserId, g.GoalId, t.TemplateId, t.Title, t.Description, t.Type,
+           CASE t.Type
+               WHEN 'LIMIT_SPENDING' THEN
+                   CASE WHEN g.weekly > 0 THEN ROUND(g.weekly * (1 - 0.05 * t.DifficultyLevel)) ELSE t.DefaultTargetAmount END
+               WHEN 'STREAK' THEN t.DefaultTargetAmount
+               ELSE MIN(g.remaining, ROUND(IFNULL(t.DefaultTargetAmount, 0) * g.scale))
+           END,
+           :week, date(:week, '+' || (MIN(7, IFNULL(t.EstimatedDurationDays, 7)) - 1) || ' days'), :week
+    FROM open_goals g
+    JOIN levels l ON l.tier = CASE WHEN g.scale < 0.8 THEN 1 WHEN g.scale > 1.25 THEN 3 ELSE 2 END
+    JOIN templates t ON t.DifficultyLevel = l.level
+                    AND t.position = (g.GoalId + CAST(julianday(:week) / 7 AS INTEGER)) % t.siblings
+    WHERE true
+    ON CONFLICT (GoalId, Week) WHERE Week IS NOT NULL DO NOTHING
+"""
+
+def week_start(day):
+    """The Monday of the week containing `day` (a date)."""
+    return day - timedelta(days=day.weekday())
+
+def generate_weekly_missions(conn, day=None):
+    """
+    Creates the missions of the week containing `day` (default: today)
+    for every open goal that has none yet, inside the caller's transaction.
+    Returns (week start, number of missions created).
+    """
+    week = week_start(day or date.today()).isoformat()
+    cur = conn.execute(GENERATE_SQL, {"week": week})
+    return week, cur.rowcount
@@ -1,16 +1,39 @@
-from pathlib import Path
 
+import argparse
 import sqlite3
 import random
 from datetime import datetime, timedelta
-from collections import defaultdict
+from multiprocessing import Pool
+
+try:
+    from db.create import create_db, rebuild_category_spending, rebuild_daily_balances
+    from db.reconcile import reconcile_balances
+except ImportError:  # run as a script from db/ (python db/init.py)
+    from create import create_db, rebuild_category_spending, rebuild_daily_balances
+    from reconcile import reconcile_balances
 
 DB_PATH = "db/goalflow.db"
 
-random.seed(42)
+SEED = 42
 START_DATE = datetime(2024, 10, 1)
 END_DATE = datetime(2025, 10, 1)
 
+# Accounts are generated in fixed-size chunks, each with its own RNG, so the
+# output depends only on the seed and never on the number of workers. The
+# first chunk uses the seed itself, which keeps the default 3-account
+# database identical to the original sequential generator.
+ACCOUNTS_PER_CHUNK = 64
+INSERT_CHUNK_SIZE = 50000  # rows per executemany() call
+
+# Applied for the duration of a load; the database is rebuilt from scratch,
+# so durability is traded for speed until the final commit.
+BULK_LOAD_PRAGMAS = (
+    "PRAGMA synchronous = OFF;",
+    "PRAGMA cache_size = -262144;",     # ~256 MB page cache
+    "PRAGMA temp_store = MEMORY;",
+    "PRAGMA locking_mode = EXCLUSIVE;",
+)
+
 EXPENSE_CATEGORIES = [
     ("RENT", 0.08, 1400, 2200),
     ("GROCERIES", 0.22, 35, 120),
@@ -31,18 +54,40 @@ INCOME_CATEGORIES = [
     ("BONUS", 0.05),
 ]
 
+NAMED_ACCOUNTS = [
+    ("Sarah", "Johnson", "5551110001", "sarah.johnson@example.com", 0.0),
+    ("Alex", "Smith", "5552220002", "alex.smith@example.com", 0.0),
+    ("Maria", "Rodriguez", "5553330003", "maria.rod@example.com", 0.0),
+]
+
+SCHEDULES = ("semi-monthly", "monthly", "biweekly")
+
+# (title, description, type, difficulty, default target)
+MISSION_TEMPLATES = [
+    ("Weekly saving", "Put some money towards your goal this week.", "SAVE", 1, 25.0),
+    ("Save a little more", "Grow your goal a bit faster this week.", "SAVE", 2, 50.0),
+    ("Big saver", "Make a large contribution to your goal.", "SAVE", 3, 100.0),
+    ("Trim your spending", "Spend a little less than usual this week.", "LIMIT_SPENDING", 1, 300.0),
+    ("Spend less this week", "Keep your spending under the limit.", "LIMIT_SPENDING", 2, 250.0),
+    ("Frugal week", "Cut your spending well below your usual week.", "LIMIT_SPENDING", 3, 200.0),
+    ("Saving streak", "Contribute to your goal 3 days in a row.", "STREAK", 1, 3.0),
+    ("Keep it going", "Contribute to your goal 5 days in a row.", "STREAK", 2, 5.0),
+    ("Daily saver", "Contribute to your goal every day this week.", "STREAK", 3, 7.0),
+    ("Move money to savings", "Transfer money to your savings account.", "TRANSFER", 2, 50.0),
+]
+
 def daterange(start, end):
     curr = start
     while curr < end:
         yield curr
         curr += timedelta(days=1)
 
-def pick_amount(low, high):
-    return round(random.uniform(low, high), 2)
+def pick_amount(rng, low, high):
+    return round(rng.uniform(low, high), 2)
 
-def weighted_choice(options):
+def weighted_choice(rng, options):
     total = sum(w for _, w in options)
-    r = random.uniform(0, total)
+    r = rng.uniform(0, total)
     upto = 0
     for name, weight in options:
         if upto + weight >= r:
@@ -61,126 +106,201 @@ def reset_tables(conn):
         DELETE FROM GoalTransactions;
         DELETE FROM Goals;
         DELETE FROM Transactions;
+        DELETE FROM AccountDailyBalances;
+        DELETE FROM AccountCategorySpending;
         DELETE FROM Accounts;
+        DELETE FROM Watermarks;
+        DELETE FROM sqlite_sequence;
+        -- Counters restart with the data; a new epoch keeps ETags issued
+        -- for the old data from matching.
+        DELETE FROM ChangeCounters;
+        INSERT INTO ChangeCounters (scope, version) VALUES ('epoch', abs(random()));
     """)
     conn.commit()
 
-def insert_accounts(conn):
-    accounts = [
-        ("Sarah", "Johnson", "5551110001", "sarah.johnson@example.com", 0.0),
-        ("Alex", "Smith", "5552220002", "alex.smith@example.com", 0.0),
-        ("Maria", "Rodriguez", "5553330003", "maria.rod@example.com", 0.0),
-    ]
+def account_rows(count):
+    """The three named accounts, followed by synthetic ones."""
+    for n in range(count):
+        if n < len(NAMED_ACCOUNTS):
+            yield NAMED_ACCOUNTS[n]
+        else:
+            yield ("User", f"{n:07d}", f"9{n:09d}", f"user{n}@example.com", 0.0)
+
+def insert_accounts(conn, count=len(NAMED_ACCOUNTS)):
     cur = conn.cursor()
     cur.executemany(
         "INSERT INTO Accounts (first_name,last_name,phone_number,email,balance) VALUES (?,?,?,?,?)",
-        accounts
+        account_rows(count)
     )
     conn.commit()
     cur.execute("SELECT id, first_name, last_name FROM Accounts ORDER BY id;")
     return [(r[0], r[1], r[2]) for r in cur.fetchall()]
 
-def salary_schedule_for_user(user_name):
+def insert_mission_templates(conn):
+    conn.executemany("""
+        INSERT INTO MissionTemplates (Title, Description, Type, DifficultyLevel, DefaultTargetAmount)
+        VALUES (?, ?, ?, ?, ?)
+    """, MISSION_TEMPLATES)
+    conn.commit()
+
+def salary_schedule_for_user(user_name, n=0):
     if user_name == "Sarah":
         return "semi-monthly"
     if user_name == "Alex":
         return "monthly"
     if user_name == "Maria":
         return "biweekly"
-    return "monthly"
+    return SCHEDULES[n % len(SCHEDULES)]
 
-def salary_amount_for_user(user_name):
+def salary_amount_for_user(user_name, n=0):
     if user_name == "Sarah":
         return 2600.0
     if user_name == "Alex":
         return 1200.0
     if user_name == "Maria":
         return 3400.0
-    return 2000.0
-
-def insert_transactions(conn, accounts):
-    cur = conn.cursor()
-    tx_count_by_acc = defaultdict(int)
-    inflow_by_acc = defaultdict(float)
-    outflow_by_acc = defaultdict(float)
+    return 1200.0 + (n * 7919 % 23) * 100.0
 
-    next_biweekly = {}
+def chunk_rng(seed, chunk):
+    return random.Random(seed if chunk == 0 else f"{seed}:{chunk}")
 
-    for acc_id, first_name, _ in accounts:
-        schedule = salary_schedule_for_user(first_name)
-        salary = salary_amount_for_user(first_name)
+def generate_transactions(job):
+    """
+    Transactions rows for one chunk of accounts, in insertion order.
+    `job` is (chunk index, [(account id, schedule, salary)], start, end, seed)
+    so it can be shipped to a worker process.
+    """
+    chunk, accounts, start, end, seed = job
+    rng = chunk_rng(seed, chunk)
+    rows = []
+    add = rows.append
 
-        if schedule == "biweekly":
-            next_biweekly[acc_id] = START_DATE
+    for acc_id, schedule, salary in accounts:
+        next_biweekly = start
 
-        for day in daterange(START_DATE, END_DATE):
+        for day in daterange(start, end):
             if schedule == "monthly" and day.day == 1:
-                cur.execute("INSERT INTO Transactions (origin_account,destination_account,amount,datetime,business_type) VALUES (?,?,?,?,?)",
-                    (None, acc_id, salary, day.strftime("%Y-%m-%d 09:00:00"), "PAYROLL"))
-                inflow_by_acc[acc_id] += salary
-                tx_count_by_acc[acc_id] += 1
+                add((None, acc_id, salary, day.strftime("%Y-%m-%d 09:00:00"), "PAYROLL"))
 
             elif schedule == "semi-monthly" and day.day in (1, 15):
-                cur.execute("INSERT INTO Transactions (origin_account,destination_account,amount,datetime,business_type) VALUES (?,?,?,?,?)",
-                    (None, acc_id, salary, day.strftime("%Y-%m-%d 09:00:00"), "PAYROLL"))
-                inflow_by_acc[acc_id] += salary
-                tx_count_by_acc[acc_id] += 1
-
-            elif schedule == "biweekly" and day >= next_biweekly.get(acc_id, START_DATE):
-                cur.execute("INSERT INTO Transactions (origin_account,destination_account,amount,datetime,business_type) VALUES (?,?,?,?,?)",
-                    (None, acc_id, salary, day.strftime("%Y-%m-%d 09:00:00"), "PAYROLL"))
-                inflow_by_acc[acc_id] += salary
-                tx_count_by_acc[acc_id] += 1
-                next_biweekly[acc_id] = day + timedelta(days=14)
+                add((None, acc_id, salary, day.strftime("%Y-%m-%d 09:00:00"), "PAYROLL"))
+
+            elif schedule == "biweekly" and day >= next_biweekly:
+                add((None, acc_id, salary, day.strftime("%Y-%m-%d 09:00:00"), "PAYROLL"))
+                next_biweekly = day + timedelta(days=14)
 
             if day.day == 3:
-                rent_amount = pick_amount(1500, 2200)
-                cur.execute("INSERT INTO Transactions (origin_account,destination_account,amount,datetime,business_type) VALUES (?,?,?,?,?)",
-                    (acc_id, None, rent_amount, day.strftime("%Y-%m-%d 10:00:00"), "RENT"))
-                outflow_by_acc[acc_id] += rent_amount
-                tx_count_by_acc[acc_id] += 1
+                rent_amount = pick_amount(rng, 1500, 2200)
+                add((acc_id, None, rent_amount, day.strftime("%Y-%m-%d 10:00:00"), "RENT"))
 
-            n = random.randint(1, 3)
+            n = rng.randint(1, 3)
             if day.weekday() >= 5:
                 n += 1
             for _ in range(n):
-                cat, _, low, high = random.choice(EXPENSE_CATEGORIES)
-                amount = pick_amount(low, high)
-                if cat in ("ENTERTAINMENT", "RESTAURANT", "ONLINE_SHOPPING") and day.weekday() < 4 and random.random() < 0.5:
+                cat, _, low, high = rng.choice(EXPENSE_CATEGORIES)
+                amount = pick_amount(rng, low, high)
+                if cat in ("ENTERTAINMENT", "RESTAURANT", "ONLINE_SHOPPING") and day.weekday() < 4 and rng.random() < 0.5:
                     continue
-                time_str = f"{day.strftime('%Y-%m-%d')} {random.randint(8, 22):02d}:{random.randint(0,59):02d}:00"
-                cur.execute("INSERT INTO Transactions (origin_account,destination_account,amount,datetime,business_type) VALUES (?,?,?,?,?)",
-                    (acc_id, None, amount, time_str, cat))
-                outflow_by_acc[acc_id] += amount
-                tx_count_by_acc[acc_id] += 1
+                time_str = f"{day.strftime('%Y-%m-%d')} {rng.randint(8, 22):02d}:{rng.randint(0,59):02d}:00"
+                add((acc_id, None, amount, time_str, cat))
+
+    return rows
+
+def transaction_jobs(accounts, start, end, seed):
+    plans = [
+        (acc_id, salary_schedule_for_user(first_name, n), salary_amount_for_user(first_name, n))
+        for n, (acc_id, first_name, _) in enumerate(accounts)
+    ]
+    for chunk, offset in enumerate(range(0, len(plans), ACCOUNTS_PER_CHUNK)):
+        yield (chunk, plans[offset:offset + ACCOUNTS_PER_CHUNK], start, end, seed)
+
+def insert_transactions(conn, accounts, start=START_DATE, end=END_DATE, seed=SEED, workers=1):
+    """
+    Generates and inserts the transactions of `accounts`, chunk by chunk
+    (in `workers` processes when above 1), through chunked executemany()
+    calls in chunk order. Returns the number of rows inserted.
+    """
+    jobs = transaction_jobs(accounts, start, end, seed)
+    sql = "INSERT INTO Transactions (origin_account,destination_account,amount,datetime,business_type) VALUES (?,?,?,?,?)"
+    total = 0
+
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        chunks = pool.imap(generate_transactions, jobs) if pool else map(generate_transactions, jobs)
+        for rows in chunks:
+            for offset in range(0, len(rows), INSERT_CHUNK_SIZE):
+                conn.executemany(sql, rows[offset:offset + INSERT_CHUNK_SIZE])
+            total += len(rows)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
 
     conn.commit()
-    return tx_count_by_acc, inflow_by_acc, outflow_by_acc
+    return total
+
+def drop_indexes(conn, table):
+    """Drops the secondary indexes of `table` and returns their SQL."""
+    indexes = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+        (table,)
+    ).fetchall()
+    for name, _ in indexes:
+        conn.execute(f"DROP INDEX {name}")
+    return [sql for _, sql in indexes]
 
 def recompute_and_update_balances(conn):
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM Accounts ORDER BY id;")
-    ids = [r[0] for r in cur.fetchall()]
-    for acc_id in ids:
-        cur.execute("""
-            SELECT 
-                IFNULL(SUM(CASE WHEN destination_account = ? THEN amount ELSE 0 END), 0) -
-                IFNULL(SUM(CASE WHEN origin_account = ? THEN amount ELSE 0 END), 0)
-            FROM Transactions
-        """, (acc_id, acc_id))
-        bal = round(float(cur.fetchone()[0] or 0.0), 2)
-        cur.execute("UPDATE Accounts SET balance = ?, last_updated = datetime('now') WHERE id = ?", (bal, acc_id))
+    """Sets every balance from the ledger in one grouped pass."""
+    reconcile_balances(conn)
     conn.commit()
 
-def populate_db():
-    conn = sqlite3.connect(DB_PATH)
+def populate_db(db_path=DB_PATH, accounts=len(NAMED_ACCOUNTS), start=START_DATE, end=END_DATE,
+                seed=SEED, workers=1):
+    """
+    Replaces the data in `db_path` with `accounts` accounts and their
+    transactions between `start` and `end`. The defaults reproduce the
+    original sample database.
+    """
+    conn = sqlite3.connect(db_path)
     ensure_fk(conn)
     reset_tables(conn)
 
-    accounts = insert_accounts(conn)
-    insert_transactions(conn, accounts)
+    for pragma in BULK_LOAD_PRAGMAS:
+        conn.execute(pragma)
+    # Rows are generated against known account ids; skip per-row FK checks
+    # and build the indexes once, after the load.
+    conn.execute("PRAGMA foreign_keys = OFF;")
+    index_sql = drop_indexes(conn, "Transactions")
+
+    account_list = insert_accounts(conn, accounts)
+    insert_mission_templates(conn)
+    count = insert_transactions(conn, account_list, start, end, seed, workers)
+
+    for sql in index_sql:
+        conn.execute(sql)
+    conn.execute("ANALYZE;")
+    ensure_fk(conn)
     recompute_and_update_balances(conn)
+    rebuild_daily_balances(conn)
+    rebuild_category_spending(conn)
+    conn.commit()
     conn.close()
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill the GoalFlow database with generated data.")
+    parser.add_argument("--db", default=DB_PATH, help="database file (created if missing)")
+    parser.add_argument("--accounts", type=int, default=len(NAMED_ACCOUNTS))
+    parser.add_argument("--start", type=datetime.fromisoformat, default=START_DATE, help="first day (YYYY-MM-DD)")
+    parser.add_argument("--end", type=datetime.fromisoformat, default=END_DATE, help="day after the last one (YYYY-MM-DD)")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--workers", type=int, default=1, help="generator processes")
+    args = parser.parse_args()
+
+    # Creates the file if missing and brings an existing one up to date
+    create_db(args.db)
+    count = populate_db(args.db, args.accounts, args.start, args.end, args.seed, args.workers)
+    print(f"Inserted {args.accounts} accounts and {count} transactions into {args.db}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,92 @@
+import json
+
+# ------------------------------------------------------
+# Balance reconciliation against the Transactions ledger
+# ------------------------------------------------------
+#
+# An account's ledger balance is the balance it was opened with plus
+# everything it received minus everything it sent. Both directions are
+# aggregated in one grouped pass over Transactions (or, with a watermark,
+# over the rows of the touched accounts only, through the origin/destination
+# indexes), and drifting balances are fixed with a single UPDATE ... FROM.
+
+# Accounts that appear in a transaction with id > :since
+TOUCHED_SQL = """
+    SELECT origin_account FROM Transactions WHERE id > :since AND origin_account IS NOT NULL
+    UNION
+    SELECT destination_account FROM Transactions WHERE id > :since AND destination_account IS NOT NULL
+"""
+
+# id, stored balance, ledger balance and their difference for every account
+# whose stored balance is off by a cent or more
+DRIFT_SQL = """
+    WITH scope AS (
+        SELECT id, balance, opening_balance FROM Accounts
+        WHERE :since IS NULL OR id IN ({touched})
+    ), flows AS (
+        SELECT destination_account AS account_id, amount FROM Transactions
+        WHERE destination_account IN (SELECT id FROM scope)
+        UNION ALL
+        SELECT origin_account, -amount FROM Transactions
+        WHERE origin_account IN (SELECT id FROM scope)
+    ), ledger AS (
+        SELECT account_id, SUM(amount) AS balance FROM flows GROUP BY account_id
+    )
+    SELECT scope.id AS account_id,
+           scope.balance AS stored_balance,
+           ROUND(scope.opening_balance + IFNULL(ledger.balance, 0), 2) AS ledger_balance,
+           ROUND(IFNULL(scope.balance, 0) - scope.opening_balance - IFNULL(ledger.balance, 0), 2) AS drift
+    FROM scope LEFT JOIN ledger ON ledger.account_id = scope.id
+    WHERE ROUND(IFNULL(scope.balance, 0) - scope.opening_balance - IFNULL(ledger.balance, 0), 2) <> 0
+       OR scope.balance IS NULL
+    ORDER BY scope.id
+""".format(touched=TOUCHED_SQL)
+
+def ledger_watermark(conn):
+    """The highest transaction id so far, to pass as `since` next time."""
+    return conn.execute("SELECT IFNULL(MAX(id), 0) FROM Transactions").fetchone()[0]
+
+def balance_drift(conn, since=None):
+    """
+    Accounts whose stored balance differs from the ledger, as
+    (account_id, stored_balance, ledger_balance, drift) rows. With `since`,
+    only accounts with a transaction id above it are checked.
+    """
+    return conn.execute(DRIFT_SQL, {"since": since}).fetchall()
+
+def reconcile_balances(conn, since=None):
+    """
+    Sets every drifting balance to its ledger balance (moving the daily
+    rollup with it) and returns the drift rows that were fixed. Runs inside
+    the caller's transaction.
+    """
+    drift = balance_drift(conn, since)
+    if not drift:
+        return drift
+    # The drift rows are passed as one JSON array of [account_id, drift]
+    payload = (json.dumps([[r[0], r[3]] for r in drift]),)
+    conn.execute("""
+        UPDATE Accounts
+        SET balance = ROUND(IFNULL(balance, 0) - d.drift, 2), last_updated = datetime('now')
+        FROM (
+            SELECT json_extract(value, '$[0]') AS account_id, json_extract(value, '$[1]') AS drift
+            FROM json_each(?)
+        ) AS d
+        WHERE Accounts.id = d.account_id
+    """, payload)
+    # Re-anchor the daily rollup so the latest close equals the corrected
+    # balance, whether or not the drift had reached the rollup
+    conn.execute("""
+        UPDATE AccountDailyBalances
+        SET closing_balance = closing_balance + d.offset
+        FROM (
+            SELECT a.id AS account_id, a.balance - (
+                SELECT closing_balance FROM AccountDailyBalances
+                WHERE account_id = a.id ORDER BY date DESC LIMIT 1
+            ) AS offset
+            FROM Accounts a
+            WHERE a.id IN (SELECT json_extract(value, '$[0]') FROM json_each(?))
+        ) AS d
+        WHERE AccountDailyBalances.account_id = d.account_id AND d.offset <> 0
+    """, payload)
+    return drift
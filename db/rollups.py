@@ -0,0 +1,98 @@
+# ------------------------------------------------------
+# Incremental maintenance of the rollup tables
+# ------------------------------------------------------
+#
+# Called by the API write paths inside their write transaction, before the
+# matching Accounts.balance update, so that rollups and balances commit
+# together. Full rebuilds live in db/create.py.
+
+from db.create import SPENDING_PERIODS
+
+# Every day on or after the changed one closes `net` higher
+SHIFT_CLOSING_SQL = """
+    UPDATE AccountDailyBalances
+    SET closing_balance = closing_balance + :inflow - :outflow
+    WHERE account_id = :account_id AND date >= date(:when)
+"""
+
+# A new day closes at the previous day's close plus its own net flow; with no
+# earlier day, at the next day's (already shifted) opening; for the very
+# first day of an account, at its balance before this change plus the flow.
+UPSERT_DAY_SQL = """
+    INSERT INTO AccountDailyBalances (account_id, date, inflow, outflow, closing_balance)
+    VALUES (:account_id, date(:when), :inflow, :outflow, COALESCE(
+        (SELECT closing_balance + :inflow - :outflow FROM AccountDailyBalances
+         WHERE account_id = :account_id AND date < date(:when)
+         ORDER BY date DESC LIMIT 1),
+        (SELECT closing_balance - (inflow - outflow) FROM AccountDailyBalances
+         WHERE account_id = :account_id AND date > date(:when)
+         ORDER BY date LIMIT 1),
+        (SELECT balance + :inflow - :outflow FROM Accounts WHERE id = :account_id)
+    ))
+    ON CONFLICT (account_id, date) DO UPDATE SET
+        inflow = inflow + excluded.inflow,
+        outflow = outflow + excluded.outflow
+"""
+
+def record_flow(conn, account_id, when, inflow=0.0, outflow=0.0):
+    """
+    Adds `inflow` / `outflow` (either may be negative to undo a flow) to the
+    account's day containing `when`.
+    """
+    params = {"account_id": account_id, "when": when, "inflow": inflow, "outflow": outflow}
+    conn.execute(SHIFT_CLOSING_SQL, params)
+    conn.execute(UPSERT_DAY_SQL, params)
+
+def record_flows(conn, flows):
+    """
+    Applies many (account_id, day, inflow, outflow) changes. Days are
+    processed in ascending order per account so each new day can build on
+    the one before it.
+    """
+    for account_id, day, inflow, outflow in sorted(flows):
+        record_flow(conn, account_id, day, inflow, outflow)
+
+def shift_balances(conn, account_id, delta):
+    """Moves every closing balance of an account, e.g. after a manual balance edit."""
+    conn.execute(
+        "UPDATE AccountDailyBalances SET closing_balance = closing_balance + ? WHERE account_id = ?",
+        (delta, account_id)
+    )
+
+# Spending lands in one row per grain (db/create.py SPENDING_PERIODS)
+UPSERT_SPENDING_SQL = f"""
+    INSERT INTO AccountCategorySpending (account_id, grain, period, category, amount, transactions)
+    SELECT :account_id, grain, period, IFNULL(:category, 'UNCATEGORIZED'), :amount, :transactions
+    FROM ({" UNION ALL ".join(
+        f"SELECT '{grain}' AS grain, {period.format(when=':when')} AS period"
+        for grain, period in SPENDING_PERIODS.items()
+    )})
+    WHERE true
+    ON CONFLICT (account_id, grain, period, category) DO UPDATE SET
+        amount = amount + excluded.amount,
+        transactions = transactions + excluded.transactions
+"""
+
+# A category's period row goes away with its last transaction
+PRUNE_SPENDING_SQL = """
+    DELETE FROM AccountCategorySpending
+    WHERE account_id = :account_id AND category = IFNULL(:category, 'UNCATEGORIZED') AND transactions <= 0
+"""
+
+def record_spending(conn, account_id, when, category, amount, transactions=1):
+    """
+    Adds `amount` spent in `category` on `when` to the account's month and
+    week; pass negative values to undo, or transactions=0 for an edited amount.
+    """
+    params = {"account_id": account_id, "when": when, "category": category,
+              "amount": amount, "transactions": transactions}
+    conn.execute(UPSERT_SPENDING_SQL, params)
+    if transactions < 0:
+        conn.execute(PRUNE_SPENDING_SQL, params)
+
+def record_spendings(conn, spendings):
+    """Applies many (account_id, day, category, amount, transactions) changes."""
+    conn.executemany(UPSERT_SPENDING_SQL, [
+        {"account_id": account_id, "when": day, "category": category, "amount": amount, "transactions": transactions}
+        for account_id, day, category, amount, transactions in spendings
+    ])
@@ -1,50 +1,169 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, current_app, jsonify, request
 import sqlite3
+from datetime import date
 
-accounts_bp = Blueprint('accounts', __name__)
+from db.connection import get_db, run_write
+from db.create import SPENDING_PERIODS
+from db.reconcile import balance_drift, ledger_watermark
+from db.rollups import shift_balances
+from routes.etags import conditional
+from routes.events import MAX_SUBSCRIBERS, event_stream, format_event, publish_balances, subscribe, unsubscribe
+from routes.projection import requested_fields, response_format, select_list, serialize, table_columns
 
-DB_PATH = "db/goalflow.db"
+accounts_bp = Blueprint('accounts', __name__)
 
 # --- GET ---
 @accounts_bp.route('/', methods=['GET'])
+@conditional("Accounts")
 def get_all_accounts():
-    with sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False) as conn:
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM Accounts")
-        rows = cur.fetchall()
-    return jsonify([dict(row) for row in rows])
+    conn = get_db()
+    try:
+        fields = requested_fields(table_columns(conn, "Accounts"))
+        fmt = response_format()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rows = conn.execute(f"SELECT {select_list(fields)} FROM Accounts").fetchall()
+    return jsonify(serialize(rows, fields, fmt))
 
 @accounts_bp.route('/<int:account_id>', methods=['GET'])
+@conditional("Accounts:{account_id}")
 def get_account(account_id):
-    with sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False) as conn:
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM Accounts WHERE id = ?", (account_id,))
-        row = cur.fetchone()
+    conn = get_db()
+    row = conn.execute("SELECT * FROM Accounts WHERE id = ?", (account_id,)).fetchone()
     if not row:
         return jsonify({"error": "Account not found"}), 404
     return jsonify(dict(row))
 
+@accounts_bp.route('/<int:account_id>/history', methods=['GET'])
+def get_account_history(account_id):
+    """
+    Daily inflow, outflow and closing balance of an account, oldest first,
+    read from the AccountDailyBalances rollup. Days without activity are
+    omitted (their balance is the previous day's close).
+    Optional query params:
+      - from (YYYY-MM-DD): first day included
+      - to (YYYY-MM-DD): last day included
+    """
+    conn = get_db()
+    if not conn.execute("SELECT 1 FROM Accounts WHERE id = ?", (account_id,)).fetchone():
+        return jsonify({"error": "Account not found"}), 404
+    try:
+        since = date.fromisoformat(request.args.get("from", "0001-01-01")).isoformat()
+        until = date.fromisoformat(request.args.get("to", "9999-12-31")).isoformat()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rows = conn.execute("""
+        SELECT date, inflow, outflow, closing_balance FROM AccountDailyBalances
+        WHERE account_id = ? AND date BETWEEN ? AND ?
+        ORDER BY date
+    """, (account_id, since, until)).fetchall()
+    return jsonify([dict(row) for row in rows])
+
+@accounts_bp.route('/<int:account_id>/spending', methods=['GET'])
+@conditional("Accounts:{account_id}")
+def get_account_spending(account_id):
+    """
+    Money that left an account per category (business_type), per month or
+    week, oldest first, read from the AccountCategorySpending rollup.
+    Periods are keyed by their first day (weeks start on Monday) and
+    returned whole when they overlap the range.
+    Optional query params:
+      - from (YYYY-MM-DD): first day included
+      - to (YYYY-MM-DD): last day included
+      - group (month|week): default month
+    """
+    group = request.args.get("group", "month")
+    if group not in SPENDING_PERIODS:
+        return jsonify({"error": f"group must be one of: {', '.join(SPENDING_PERIODS)}"}), 400
+    try:
+        since = date.fromisoformat(request.args.get("from", "0001-01-01")).isoformat()
+        until = date.fromisoformat(request.args.get("to", "9999-12-31")).isoformat()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    conn = get_db()
+    if not conn.execute("SELECT 1 FROM Accounts WHERE id = ?", (account_id,)).fetchone():
+        return jsonify({"error": "Account not found"}), 404
+    rows = conn.execute(f"""
+        SELECT period, category, amount, transactions FROM AccountCategorySpending
+        WHERE account_id = ? AND grain = ? AND period BETWEEN {SPENDING_PERIODS[group].format(when="?")} AND ?
+        ORDER BY period, category
+    """, (account_id, group, since, until)).fetchall()
+
+    periods = []
+    for row in rows:
+        if not periods or periods[-1]["period"] != row["period"]:
+            periods.append({"period": row["period"], "total": 0.0, "transactions": 0, "categories": {}})
+        current = periods[-1]
+        current["categories"][row["category"]] = round(row["amount"], 2)
+        current["total"] += row["amount"]
+        current["transactions"] += row["transactions"]
+    for current in periods:
+        current["total"] = round(current["total"], 2)
+    return jsonify({"account_id": account_id, "group": group, "periods": periods})
+
+@accounts_bp.route('/<int:account_id>/events', methods=['GET'])
+def get_account_events(account_id):
+    """
+    Server-sent events for an account: its current balance first, then
+    "balance", "goal" and "mission" events as they change (see
+    routes/events.py), and "resync" if the client fell too far behind.
+    """
+    conn = get_db()
+    # Subscribed before the snapshot is read, so no change falls in between
+    subscriber = subscribe(account_id, current_app.config.get("MAX_EVENT_STREAMS", MAX_SUBSCRIBERS))
+    if subscriber is None:
+        return jsonify({"error": "Too many event streams"}), 503
+    account = conn.execute("SELECT balance FROM Accounts WHERE id = ?", (account_id,)).fetchone()
+    if not account:
+        unsubscribe(account_id, subscriber)
+        return jsonify({"error": "Account not found"}), 404
+    initial = [format_event("balance", {"account_id": account_id, "balance": account["balance"]})]
+    # The stream holds no database connection: ours goes back to the pool now
+    response = Response(event_stream(subscriber, initial), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    response.call_on_close(lambda: unsubscribe(account_id, subscriber))
+    return response
+
+@accounts_bp.route('/reconcile', methods=['GET'])
+def reconcile_accounts():
+    """
+    Reports accounts whose stored balance differs from the Transactions
+    ledger. Fixing them is left to `flask reconcile --apply`, run by hand.
+    Optional query params:
+      - since (transaction id): only check accounts with a transaction
+        after it, e.g. the `watermark` returned by the previous call
+    """
+    since = request.args.get("since")
+    if since is not None:
+        if not since.isdigit():
+            return jsonify({"error": "since must be a transaction id"}), 400
+        since = int(since)
+    conn = get_db()
+    watermark = ledger_watermark(conn)
+    drift = balance_drift(conn, since)
+    return jsonify({
+        "watermark": watermark,
+        "accounts": [dict(row) for row in drift],
+    })
+
 # --- POST ---
 @accounts_bp.route('/', methods=['POST'])
 def add_account():
     data = request.get_json()
     try:
-        with sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False) as conn:
-            conn.execute("PRAGMA journal_mode=WAL;")
-            cur = conn.cursor()
-            cur.execute("""
-                INSERT INTO Accounts (first_name, last_name, phone_number, email, balance)
-                VALUES (?, ?, ?, ?, ?)
-            """, (
-                data['first_name'],
-                data['last_name'],
-                data['phone_number'],
-                data['email'],
-                data.get('balance', 0.0)
-            ))
-            conn.commit()
+        run_write(lambda conn: conn.execute("""
+            INSERT INTO Accounts (first_name, last_name, phone_number, email, balance, opening_balance)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (
+            data['first_name'],
+            data['last_name'],
+            data['phone_number'],
+            data['email'],
+            data.get('balance', 0.0),
+            data.get('balance', 0.0)
+        )))
         return jsonify({"message": "Account created successfully"}), 201
     except sqlite3.IntegrityError as e:
         return jsonify({"error": str(e)}), 400
@@ -62,17 +181,24 @@ def update_account(account_id):
     if not fields:
         return jsonify({"error": "No fields to update"}), 400
     values.append(account_id)
-    with sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False) as conn:
-        cur = conn.cursor()
-        cur.execute(f"UPDATE Accounts SET {', '.join(fields)} WHERE id = ?", values)
-        conn.commit()
+
+    def write(conn):
+        old = conn.execute("SELECT balance FROM Accounts WHERE id = ?", (account_id,)).fetchone()
+        conn.execute(f"UPDATE Accounts SET {', '.join(fields)} WHERE id = ?", values)
+        # A manual balance edit moves the whole daily balance history with it,
+        # and the opening balance, so that it does not count as drift
+        if old and "balance" in data:
+            delta = data["balance"] - (old["balance"] or 0.0)
+            shift_balances(conn, account_id, delta)
+            conn.execute("UPDATE Accounts SET opening_balance = opening_balance + ? WHERE id = ?", (delta, account_id))
+
+    run_write(write)
+    if "balance" in data:
+        publish_balances(get_db(), account_id)
     return jsonify({"message": "Account updated"})
 
 # --- DELETE ---
 @accounts_bp.route('/<int:account_id>', methods=['DELETE'])
 def delete_account(account_id):
-    with sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False) as conn:
-        cur = conn.cursor()
-        cur.execute("DELETE FROM Accounts WHERE id = ?", (account_id,))
-        conn.commit()
+    run_write(lambda conn: conn.execute("DELETE FROM Accounts WHERE id = ?", (account_id,)))
     return jsonify({"message": "Account deleted"})
@@ -0,0 +1,51 @@
+from functools import wraps
+import hashlib
+
+from flask import Response, make_response, request
+
+from db.connection import get_db
+
+# ------------------------------------------------------
+# Conditional GET support
+# ------------------------------------------------------
+#
+# ChangeCounters holds a version per table ("Goals") and per account
+# ("Goals:7"), bumped by triggers on every write (migration 4). A response's
+# ETag is derived from the versions of the scopes it depends on, so a poll
+# that sends back a current ETag is answered with 304 after one primary key
+# lookup, without running the query or serializing anything.
+
+def current_etag(conn, scopes):
+    versions = dict(conn.execute(
+        f"SELECT scope, version FROM ChangeCounters WHERE scope IN ({', '.join('?' * (len(scopes) + 1))})",
+        ("epoch", *scopes)
+    ).fetchall())
+    # The query string is part of the representation (e.g. filters)
+    parts = [str(versions.get(scope, 0)) for scope in ("epoch", *scopes)]
+    parts.append(request.query_string.decode())
+    return hashlib.blake2b("|".join(parts).encode(), digest_size=12).hexdigest()
+
+def conditional(*scopes):
+    """
+    Adds a strong ETag to the view's 200 responses and answers a matching
+    If-None-Match with 304. Scopes are format strings filled from the view's
+    URL arguments, e.g. conditional("Goals:{account_id}").
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            # Read the versions before the data: a write landing in between
+            # can pair old versions with new data, which is harmless (the
+            # next request sends a stale ETag and re-fetches), but never new
+            # versions with old data, which could be revalidated forever.
+            etag = current_etag(get_db(), [scope.format(**kwargs) for scope in scopes])
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+            response = make_response(view(**kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
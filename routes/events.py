@@ -0,0 +1,128 @@
+import itertools
+import json
+import queue
+import threading
+
+# ------------------------------------------------------
+# In-process event bus behind GET /accounts/<id>/events
+# ------------------------------------------------------
+#
+# Write handlers publish an account's balance, goal and mission changes once
+# their transaction has committed. Every open event stream subscribes with
+# its own queue of at most SUBSCRIBER_QUEUE_SIZE events: a client that falls
+# that far behind loses its backlog and gets a single "resync" event telling
+# it to refetch, so slow clients cannot grow memory. Events are only read
+# from the database when the account has subscribers.
+#
+# The bus lives in the worker process, like the forecast cache: with several
+# worker processes a stream only sees the writes handled by its own worker.
+# Each open stream holds a server thread, so the number of streams is capped
+# per process (MAX_EVENT_STREAMS); under gunicorn this needs a gthread or
+# gevent worker, with the cap below its thread count.
+
+SUBSCRIBER_QUEUE_SIZE = 100
+MAX_SUBSCRIBERS = 1000
+KEEPALIVE_SECONDS = 15
+
+_subscribers = {}  # account_id -> set of subscriber queues
+_subscriber_count = 0
+_event_ids = itertools.count(1)
+# Held while delivering too, so a resync cannot interleave with other events
+_lock = threading.Lock()
+
+def format_event(event, data, event_id=None):
+    """One text/event-stream message."""
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+RESYNC = format_event("resync", {})
+
+def subscribe(account_id, limit=MAX_SUBSCRIBERS):
+    """A new queue receiving the account's events, or None at `limit` streams."""
+    global _subscriber_count
+    with _lock:
+        if _subscriber_count >= limit:
+            return None
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        _subscribers.setdefault(account_id, set()).add(subscriber)
+        _subscriber_count += 1
+        return subscriber
+
+def unsubscribe(account_id, subscriber):
+    global _subscriber_count
+    with _lock:
+        subscribers = _subscribers.get(account_id, set())
+        if subscriber in subscribers:
+            subscribers.discard(subscriber)
+            _subscriber_count -= 1
+        if not subscribers:
+            _subscribers.pop(account_id, None)
+
+def has_subscribers(account_id):
+    return account_id in _subscribers
+
+def publish(account_id, event, data):
+    """Queues an event for every stream of the account."""
+    with _lock:
+        subscribers = _subscribers.get(account_id)
+        if not subscribers:
+            return
+        message = format_event(event, data, next(_event_ids))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # Too far behind: drop the backlog, the client refetches instead
+                while not subscriber.empty():
+                    subscriber.get_nowait()
+                subscriber.put_nowait(RESYNC)
+
+def event_stream(subscriber, initial=()):
+    """
+    The body of an event stream: the `initial` messages, then the account's
+    events as they are published, with a comment every KEEPALIVE_SECONDS so
+    that proxies keep the connection open and a gone client is noticed. The
+    caller unsubscribes once the response is closed.
+    """
+    yield from initial
+    while True:
+        try:
+            yield subscriber.get(timeout=KEEPALIVE_SECONDS)
+        except queue.Empty:
+            yield ": keepalive\n\n"
+
+# ------------------------------------------------------
+# Publishing from the write handlers
+# ------------------------------------------------------
+# Called after the commit with the connection the handler wrote on.
+
+def publish_balances(conn, *account_ids):
+    """A "balance" event with the current balance of each account."""
+    account_ids = [i for i in set(account_ids) if i is not None and has_subscribers(i)]
+    if not account_ids:
+        return
+    rows = conn.execute(
+        "SELECT id, balance FROM Accounts WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps(account_ids),)
+    ).fetchall()
+    for row in rows:
+        publish(row["id"], "balance", {"account_id": row["id"], "balance": row["balance"]})
+
+def publish_rows(conn, event, table, key, changed):
+    """An `event` with the current row of each changed (key, account id) pair."""
+    keys = [k for k, account_id in changed if has_subscribers(account_id)]
+    if not keys:
+        return
+    rows = conn.execute(
+        f"SELECT * FROM {table} WHERE {key} IN (SELECT value FROM json_each(?))", (json.dumps(keys),)
+    ).fetchall()
+    for row in rows:
+        publish(row["UserId"], event, dict(row))
+
+def publish_goals(conn, changed):
+    """A "goal" event per changed (GoalId, UserId) pair."""
+    publish_rows(conn, "goal", "Goals", "GoalId", changed)
+
+def publish_missions(conn, changed):
+    """A "mission" event per changed (MissionId, UserId) pair."""
+    publish_rows(conn, "mission", "WeeklyMissions", "MissionId", changed)
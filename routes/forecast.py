@@ -1,15 +1,156 @@
-from flask import Blueprint, jsonify, request
-from datetime import date, timedelta
+from flask import Blueprint, Response, current_app, jsonify, request
+from datetime import date
+import json
+import threading
+
+import numpy as np
+from cachetools import TTLCache
+
+from db.connection import get_db
+from routes.forecast_models import MIN_HISTORY_DAYS, MODELS, fitted_model, model_cache_stats, model_deltas
 
 forecast_bp = Blueprint("forecast", __name__)
 
+# ------------------------------------------------------
+# Response cache
+# ------------------------------------------------------
+# Serialized forecast responses, keyed by account and normalized query
+# params, kept per worker process. The key also holds the account's version
+# as read from the database (its ChangeCounters version, which every balance
+# change bumps, and its last transaction id), so a write from any process or
+# CLI command makes the entries unreachable; they then age out through
+# LRU / TTL.
+
+FORECAST_CACHE_SIZE = 1024
+FORECAST_CACHE_TTL = 300  # seconds
+
+class ForecastCache(TTLCache):
+    def __init__(self, maxsize, ttl):
+        super().__init__(maxsize, ttl)
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def popitem(self):
+        # Only called to make room, i.e. on LRU eviction
+        self.stats["evictions"] += 1
+        return super().popitem()
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        self.stats["expirations"] += len(expired)
+        return expired
+
+# The state of one account that forecasts depend on
+ACCOUNT_VERSION_SQL = """
+    SELECT (SELECT version FROM ChangeCounters WHERE scope = 'epoch'),
+           (SELECT version FROM ChangeCounters WHERE scope = 'Accounts:' || :account_id),
+           (SELECT MAX(id) FROM Transactions WHERE origin_account = :account_id),
+           (SELECT MAX(id) FROM Transactions WHERE destination_account = :account_id)
+"""
+
+_forecast_cache = ForecastCache(FORECAST_CACHE_SIZE, FORECAST_CACHE_TTL)
+_forecast_cache_lock = threading.Lock()
+
+def cached_forecast(key):
+    with _forecast_cache_lock:
+        body = _forecast_cache.get(key)
+        _forecast_cache.stats["hits" if body is not None else "misses"] += 1
+        return body
+
+def cache_forecast(key, body):
+    with _forecast_cache_lock:
+        _forecast_cache[key] = body
+
+def forecast_cache_key(conn, account_id, params):
+    version = tuple(conn.execute(ACCOUNT_VERSION_SQL, {"account_id": account_id}).fetchone())
+    return (account_id, version, date.today().isoformat(), params)
+
+def forecast_cache_stats():
+    with _forecast_cache_lock:
+        _forecast_cache.expire()
+        return {
+            **_forecast_cache.stats,
+            "size": len(_forecast_cache),
+            "maxsize": _forecast_cache.maxsize,
+            "ttl": _forecast_cache.ttl,
+        }
+
+def project_balances(initial_balance, daily_delta, daily_rate, days: int, per_day: bool = False):
+    """
+    Closed-form balance paths for any grid of scenarios.
+
+    `initial_balance`, `daily_delta` and `daily_rate` broadcast against each
+    other (shape S); the result has shape S + (days,), where day n holds
+        B * g^n + d * (g^n - 1) / (g - 1),   g = 1 + daily_rate
+    i.e. the geometric-series sum of n compounding days, or B + n * d when
+    the rate is zero.
+
+    With `per_day=True` the last axis of `daily_delta` is the day axis
+    (one net change per day) and day n holds g^n * (B + sum_k d_k / g^k).
+    """
+    if days <= 0:
+        raise ValueError("days must be positive")
+
+    n = np.arange(1, days + 1, dtype=float)
+    balance = np.asarray(initial_balance, dtype=float)[..., None]
+    rate = np.asarray(daily_rate, dtype=float)[..., None]
+
+    if per_day:
+        delta = np.asarray(daily_delta, dtype=float)
+        if delta.shape[-1] != days:
+            raise ValueError("per-day deltas must cover every forecast day")
+        growth = np.exp(n * np.log1p(rate))
+        discounted = np.broadcast_to(delta / growth, np.broadcast_shapes(delta.shape, growth.shape))
+        return growth * (balance + np.cumsum(discounted, axis=-1))
+
+    delta = np.asarray(daily_delta, dtype=float)[..., None]
+    # log1p/expm1 keep g^n - 1 accurate for tiny daily rates
+    growth_minus_one = np.expm1(n * np.log1p(rate))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        annuity = np.where(rate == 0.0, n, growth_minus_one / rate)
+    return balance * (1.0 + growth_minus_one) + delta * annuity
+
+
+def scale_deltas(baseline_daily_delta, scales):
+    """
+    Multiplies a constant or per-day baseline by per-scenario `scales`.
+    Returns (deltas, per_day) ready for project_balances().
+    """
+    scales = np.asarray(scales, dtype=float)
+    if np.ndim(baseline_daily_delta) == 0:
+        return scales * baseline_daily_delta, False
+    return scales[..., None] * np.asarray(baseline_daily_delta, dtype=float), True
+
+
+def scenario_grid(
+    initial_balance: float,
+    days: int,
+    baseline_daily_delta,
+    cd_apys,
+    ai_deltas,
+):
+    """
+    Balances for every (cd_apy, ai_delta) pair in one array operation.
+    `baseline_daily_delta` is a constant or one value per day.
+    Returns shape (len(cd_apys), len(ai_deltas), days).
+    """
+    rates = np.asarray(cd_apys, dtype=float)[:, None] / 365.0
+    deltas, per_day = scale_deltas(baseline_daily_delta, (1.0 + np.asarray(ai_deltas, dtype=float))[None, :])
+    return project_balances(initial_balance, deltas, rates, days, per_day)
+
+
+def forecast_dates(start_date: date, days: int):
+    """YYYY-MM-DD strings for the `days` days after `start_date`."""
+    first = np.datetime64(start_date, "D") + 1
+    return np.arange(first, first + days).astype(str).tolist()
+
+
 def generate_sample_forecast(
     start_date: date,
     days: int,
     initial_balance: float,
-    baseline_daily_delta: float = 10.0,  # average daily net change
-    cd_apy: float = 0.035,               # 3.5% APY
-    ai_delta: float = 0.10,              # +10% improved spending/savings
+    baseline_daily_delta=10.0,   # average daily net change, or one per day
+    cd_apy: float = 0.035,       # 3.5% APY
+    ai_delta: float = 0.10,      # +10% improved spending/savings
 ):
     """
     Generates simulated forecast data for baseline, CD, AI, and combined scenarios.
@@ -17,33 +158,20 @@ def generate_sample_forecast(
     if days <= 0:
         raise ValueError("days must be positive")
 
-    # Precompute date strings
-    dates = [(start_date + timedelta(days=i+1)).strftime("%Y-%m-%d") for i in range(days)]
+    dates = forecast_dates(start_date, days)
 
     daily_rate = cd_apy / 365.0
-    baseline, cd, ai, combined = [], [], [], []
-
-    b_prev = c_prev = a_prev = combo_prev = initial_balance
-
-    for _ in range(days):
-        # Baseline: linear change
-        b_next = b_prev + baseline_daily_delta
-
-        # CD: compound interest + same delta
-        c_next = c_prev * (1.0 + daily_rate) + baseline_daily_delta
-
-        # AI: improved daily delta (e.g. +10%)
-        ai_next = a_prev + baseline_daily_delta * (1.0 + ai_delta)
-
-        # Combined: interest + improved delta
-        combo_next = combo_prev * (1.0 + daily_rate) + baseline_daily_delta * (1.0 + ai_delta)
-
-        baseline.append(round(b_next, 2))
-        cd.append(round(c_next, 2))
-        ai.append(round(ai_next, 2))
-        combined.append(round(combo_next, 2))
 
-        b_prev, c_prev, a_prev, combo_prev = b_next, c_next, ai_next, combo_next
+    # Rows: baseline (linear), CD (interest), AI (improved delta), combined
+    deltas, per_day = scale_deltas(baseline_daily_delta, [1.0, 1.0, 1.0 + ai_delta, 1.0 + ai_delta])
+    paths = np.round(project_balances(
+        initial_balance,
+        deltas,
+        [0.0, daily_rate, 0.0, daily_rate],
+        days,
+        per_day,
+    ), 2)
+    baseline, cd, ai, combined = paths.tolist()
 
     return {
         "dates": dates,
@@ -56,31 +184,588 @@ def generate_sample_forecast(
     }
 
 
+# The `history_days` days ending on one account's last activity
+HISTORY_WINDOW_SQL = """
+    WITH last_activity AS (
+        SELECT MAX(last) AS last FROM (
+            SELECT MAX(datetime) AS last FROM Transactions WHERE destination_account = :account_id
+            UNION ALL
+            SELECT MAX(datetime) FROM Transactions WHERE origin_account = :account_id
+        )
+    ),
+    bounds AS (
+        SELECT date(last, '-' || (:history_days - 1) || ' days') AS since, date(last) AS until
+        FROM last_activity
+    )
+"""
+
+# Daily net flow of one account over its history window, aggregated in SQL
+# from the (account, datetime) indexes.
+DAILY_NET_FLOWS_SQL = HISTORY_WINDOW_SQL + """
+    SELECT date(datetime) AS day, SUM(net) AS net, (SELECT until FROM bounds) AS until
+    FROM (
+        SELECT datetime, amount AS net FROM Transactions
+        WHERE destination_account = :account_id AND datetime >= (SELECT since FROM bounds)
+        UNION ALL
+        SELECT datetime, -amount FROM Transactions
+        WHERE origin_account = :account_id AND datetime >= (SELECT since FROM bounds)
+    )
+    GROUP BY day
+    ORDER BY day
+"""
+
+
+# Reported with model forecasts
+LAST_TRANSACTION_SQL = """
+    SELECT MAX(id) FROM (
+        SELECT MAX(id) AS id FROM Transactions WHERE origin_account = :account_id
+        UNION ALL
+        SELECT MAX(id) FROM Transactions WHERE destination_account = :account_id
+    )
+"""
+
+
+def weekday_and_monthday(days):
+    """Weekday (Monday=0) and day of month for an array of datetime64[D]."""
+    weekday = (days.astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday
+    monthday = (days - days.astype("datetime64[M]").astype("datetime64[D]")).astype(np.int64) + 1
+    return weekday, monthday
+
+
+def daily_net_series(conn, account_id: int, history_days: int = 180):
+    """
+    Dense daily net flows of the account, from its first active day within
+    the history window on. Returns (days, net), or None without transactions.
+    """
+    rows = conn.execute(DAILY_NET_FLOWS_SQL, {
+        "account_id": account_id,
+        "history_days": history_days,
+    }).fetchall()
+    if not rows:
+        return None
+
+    until = np.datetime64(rows[0]["until"], "D")
+    first = max(np.datetime64(rows[0]["day"], "D"), until - (history_days - 1))
+    history = np.arange(first, until + 1)
+    net = np.zeros(len(history))
+    net[(np.array([r["day"] for r in rows], dtype="datetime64[D]") - first).astype(np.int64)] = [r["net"] for r in rows]
+    return history, net
+
+
+def profile_deltas(history, net, valid, start_date: date, days: int):
+    """
+    The baseline behind history_baseline() for many accounts at once.
+    `history` (datetime64[D]), `net` and the `valid` mask have shape
+    (accounts, history days); masked-out days are ignored. Returns per-day
+    deltas (accounts, days) and each account's mean daily net flow.
+    """
+    accounts = len(net)
+    rows = np.arange(accounts)[:, None]
+    weight = valid.astype(float)
+    net = net * weight
+    weekday, monthday = weekday_and_monthday(history)
+    mean = net.sum(axis=1) / np.maximum(weight.sum(axis=1), 1)
+
+    def averages(slot, slots, values, default):
+        # Per account and slot (day of month / weekday); `default` where unseen
+        index = (rows * slots + slot).ravel()
+        seen = np.bincount(index, weights=weight.ravel(), minlength=accounts * slots).reshape(accounts, slots)
+        total = np.bincount(index, weights=values.ravel(), minlength=accounts * slots).reshape(accounts, slots)
+        profile = np.broadcast_to(default, (accounts, slots)).copy()
+        np.divide(total, seen, out=profile, where=seen > 0)
+        return profile
+
+    monthday_profile = averages(monthday, 32, net, mean[:, None])
+    residual = (net - monthday_profile[rows, monthday]) * weight
+    weekday_profile = averages(weekday, 7, residual, 0.0)
+
+    first_day = np.datetime64(start_date, "D") + 1
+    weekday, monthday = weekday_and_monthday(np.arange(first_day, first_day + days))
+    return monthday_profile[:, monthday] + weekday_profile[:, weekday], mean
+
+
+def history_baseline(conn, account_id: int, start_date: date, days: int, history_days: int = 180):
+    """
+    Per-day baseline deltas for the forecast window, learned from the
+    account's daily net flows: a day-of-month profile (payroll, rent) plus a
+    weekday profile of what is left. Returns (deltas, summary), or
+    (None, None) when the account has no transactions.
+    """
+    series = daily_net_series(conn, account_id, history_days)
+    if series is None:
+        return None, None
+    history, net = series
+    first, until = history[0], history[-1]
+    deltas, mean = profile_deltas(history[None], net[None], np.ones((1, len(net)), dtype=bool), start_date, days)
+    deltas, mean = deltas[0], mean[0]
+
+    summary = {
+        "source": "history",
+        "history_from": str(first),
+        "history_to": str(until),
+        "avg_daily_net": round(float(mean), 2),
+    }
+    return deltas, summary
+
+
+# ------------------------------------------------------
+# Monte Carlo mode
+# ------------------------------------------------------
+# Thousands of balance paths are simulated at once as a (days, paths)
+# matrix of daily net flows, bootstrapped from the account's own history by
+# business_type, and reduced to percentile bands per scenario. Values are
+# float32: plenty for percentiles, and it lets NumPy's SIMD sort do the
+# ranking.
+
+MONTECARLO_PATHS = 10000
+MAX_SIMULATED_DAYS = 10_000_000  # paths * days
+BAND_PERCENTILES = (10, 50, 90)
+
+# Categories landing on at most this many days of the month (payroll, rent)
+# are treated as scheduled rather than resampled.
+SCHEDULED_MAX_MONTHDAYS = 3
+
+# Draws are 16-bit; each weekday's past days are spread evenly over them.
+DRAW_BITS = 16
+
+DAILY_CATEGORY_FLOWS_SQL = HISTORY_WINDOW_SQL + """
+    SELECT date(datetime) AS day, category, SUM(net) AS net, (SELECT until FROM bounds) AS until
+    FROM (
+        SELECT datetime, IFNULL(business_type, 'UNCATEGORIZED') AS category, amount AS net FROM Transactions
+        WHERE destination_account = :account_id AND datetime >= (SELECT since FROM bounds)
+        UNION ALL
+        SELECT datetime, IFNULL(business_type, 'UNCATEGORIZED'), -amount FROM Transactions
+        WHERE origin_account = :account_id AND datetime >= (SELECT since FROM bounds)
+    )
+    GROUP BY day, category
+    ORDER BY day
+"""
+
+
+def daily_category_flows(conn, account_id: int, history_days: int = 180):
+    """
+    Dense (day, category) matrix of the account's net flows over its history
+    window. Returns (days, categories, flows), or None without transactions.
+    """
+    rows = conn.execute(DAILY_CATEGORY_FLOWS_SQL, {
+        "account_id": account_id,
+        "history_days": history_days,
+    }).fetchall()
+    if not rows:
+        return None
+
+    until = np.datetime64(rows[0]["until"], "D")
+    first = max(np.datetime64(rows[0]["day"], "D"), until - (history_days - 1))
+    history = np.arange(first, until + 1)
+    categories = sorted({r["category"] for r in rows})
+    column = {category: i for i, category in enumerate(categories)}
+    flows = np.zeros((len(history), len(categories)))
+    day_index = (np.array([r["day"] for r in rows], dtype="datetime64[D]") - first).astype(np.int64)
+    flows[day_index, [column[r["category"]] for r in rows]] = [r["net"] for r in rows]
+    return history, categories, flows
+
+
+def bootstrap_net_flows(history, categories, flows, start_date: date, days: int, paths: int, rng):
+    """
+    Simulated daily net flows for the forecast window, shape (days, paths).
+
+    Scheduled categories (see SCHEDULED_MAX_MONTHDAYS) add their average for
+    each day of the month on every path. Everything else is resampled as
+    whole past days with the same weekday, so what happened together on one
+    day stays together. Returns (deltas, scheduled category names).
+    """
+    weekday, monthday = weekday_and_monthday(history)
+    active = flows != 0
+    scheduled = np.array([
+        0 < len(np.unique(monthday[active[:, c]])) <= SCHEDULED_MAX_MONTHDAYS
+        for c in range(len(categories))
+    ], dtype=bool)
+
+    seen = np.bincount(monthday, minlength=32)
+    monthday_profile = np.zeros(32)
+    np.divide(np.bincount(monthday, weights=flows[:, scheduled].sum(axis=1), minlength=32), seen,
+              out=monthday_profile, where=seen > 0)
+
+    # Per weekday, a lookup table from draw to past day; all past days stand
+    # in for weekdays the history does not cover.
+    pool = flows[:, ~scheduled].sum(axis=1)
+    picks = np.arange(1 << DRAW_BITS)
+    tables = np.empty((7, 1 << DRAW_BITS), dtype=np.float32)
+    for day in range(7):
+        same = pool[weekday == day]
+        if not len(same):
+            same = pool
+        tables[day] = same[(picks * len(same)) >> DRAW_BITS]
+
+    first_day = np.datetime64(start_date, "D") + 1
+    weekday, monthday = weekday_and_monthday(np.arange(first_day, first_day + days))
+    draws = rng.integers(0, 1 << DRAW_BITS, size=(days, paths), dtype=np.uint16)
+    deltas = np.empty((days, paths), dtype=np.float32)
+    for day in range(days):
+        np.take(tables[weekday[day]], draws[day], out=deltas[day])
+    deltas += monthday_profile[monthday].astype(np.float32)[:, None]
+    return deltas, [category for category, flag in zip(categories, scheduled) if flag]
+
+
+def montecarlo_bands(initial_balance: float, deltas, cd_apy: float, ai_delta: float,
+                     percentiles=BAND_PERCENTILES):
+    """
+    Percentile bands of the four scenarios of generate_sample_forecast()
+    over simulated daily net flows `deltas` (days, paths), which is
+    consumed. Scaling flows by 1 + ai_delta keeps the paths in order, so it
+    is applied to the bands; interest depends on when money moves, so the
+    CD scenarios rank their own discounted paths (see project_balances).
+    Returns {scenario: {"p10": [...], ...}}.
+    """
+    days, paths = deltas.shape
+    growth = np.exp(np.arange(1, days + 1) * np.log1p(cd_apy / 365.0))
+    ranks = np.maximum(np.ceil(np.asarray(percentiles) / 100 * paths).astype(np.int64) - 1, 0)
+
+    def cumulative_bands(flows):
+        # Row by row: far faster than np.cumsum(axis=0) on this layout
+        for day in range(1, days):
+            flows[day] += flows[day - 1]
+        flows.sort(axis=1)
+        return flows[:, ranks].T.astype(float)
+
+    discounted = cumulative_bands(deltas / growth.astype(np.float32)[:, None])
+    cumulative = cumulative_bands(deltas)
+    scale = 1.0 + ai_delta
+    scenarios = {
+        "baseline": initial_balance + cumulative,
+        "cd_3_5": growth * (initial_balance + discounted),
+        "ai_goals": initial_balance + scale * cumulative,
+        "combined": growth * (initial_balance + scale * discounted),
+    }
+    # A negative scale flips the bands
+    labels = [f"p{p:g}" for p in percentiles]
+    return {
+        name: dict(zip(labels, np.round(np.sort(bands, axis=0), 2).tolist()))
+        for name, bands in scenarios.items()
+    }
+
+
+def montecarlo_forecast(conn, account_id: int, start_date: date, days: int, initial_balance: float,
+                        history_days: int, cd_apy: float, ai_delta: float, paths: int, seed: int):
+    """Monte Carlo counterpart of generate_sample_forecast(); returns (result, baseline summary)."""
+    rng = np.random.default_rng(seed)
+    history = daily_category_flows(conn, account_id, history_days)
+    if history is None:
+        deltas, summary = np.zeros((days, paths), dtype=np.float32), {"source": "no_history"}
+    else:
+        past_days, categories, flows = history
+        deltas, scheduled = bootstrap_net_flows(past_days, categories, flows, start_date, days, paths, rng)
+        summary = {
+            "source": "history",
+            "history_from": str(past_days[0]),
+            "history_to": str(past_days[-1]),
+            "avg_daily_net": round(float(flows.sum(axis=1).mean()), 2),
+            "scheduled_categories": scheduled,
+        }
+    result = {
+        "dates": forecast_dates(start_date, days),
+        "scenarios": montecarlo_bands(initial_balance, deltas, cd_apy, ai_delta),
+        "simulation": {"paths": paths, "seed": seed, "percentiles": list(BAND_PERCENTILES)},
+    }
+    return result, summary
+
+
+def model_baseline(conn, account_id: int, model: str, start_date: date, days: int, history_days: int):
+    """
+    Per-day baseline deltas predicted by `model` (see routes/forecast_models.py).
+    Returns (deltas, summary), or (None, None) while the model is being fitted.
+    Too short a history falls back to history_baseline().
+    """
+    series = daily_net_series(conn, account_id, history_days)
+    if series is None:
+        return 0.0, {"source": "no_history"}
+    history, net = series
+    if len(net) < MIN_HISTORY_DAYS:
+        return history_baseline(conn, account_id, start_date, days, history_days)
+    fitted = fitted_model(
+        model, account_id, history_days, history, net,
+        wait=current_app.config.get("FORECAST_MODEL_WAIT", 5)
+    )
+    if fitted is None:
+        return None, None
+    last_transaction_id = conn.execute(LAST_TRANSACTION_SQL, {"account_id": account_id}).fetchone()[0]
+    summary = {
+        "source": "model",
+        "model": model,
+        "history_from": str(history[0]),
+        "history_to": str(history[-1]),
+        "avg_daily_net": round(float(net.mean()), 2),
+        "last_transaction_id": last_transaction_id,
+    }
+    return model_deltas(model, fitted, history[-1], start_date, days), summary
+
+
+# ------------------------------------------------------
+# Batch forecasts
+# ------------------------------------------------------
+# Balances and daily net flows of every requested account come from one
+# query over the AccountDailyBalances rollup (the same daily flows the
+# single-account forecast aggregates from Transactions), and the whole
+# accounts x cd_apy x ai_delta x days tensor is computed in one pass.
+
+MAX_BATCH_ACCOUNTS = 1000
+MAX_BATCH_VALUES = 2_000_000  # accounts * scenarios * days
+
+# One row per account; its active days in the window come as comma-separated
+# ages (days before `until`) and net flows, far cheaper to fetch than a row
+# per day. Both lists are built in the same pass, so they line up. Days whose
+# transactions were all deleted again keep a zero row, which is no activity.
+BATCH_HISTORY_SQL = """
+    WITH requested AS MATERIALIZED (
+        SELECT a.id, a.balance,
+               (SELECT MAX(date) FROM AccountDailyBalances d
+                WHERE d.account_id = a.id AND (d.inflow <> 0 OR d.outflow <> 0)) AS until
+        FROM Accounts a
+        WHERE a.id IN (SELECT value FROM json_each(:account_ids))
+    )
+    SELECT a.id AS account_id, a.balance, a.until, COUNT(d.date) AS active_days,
+           group_concat(CAST(julianday(a.until) - julianday(d.date) AS INTEGER)) AS ages,
+           group_concat(d.inflow - d.outflow) AS nets
+    FROM requested a
+    LEFT JOIN AccountDailyBalances d
+        ON d.account_id = a.id AND d.date >= date(a.until, '-' || (:history_days - 1) || ' days')
+        AND (d.inflow <> 0 OR d.outflow <> 0)
+    GROUP BY a.id
+"""
+
+
+def batch_history(conn, account_ids, history_days: int = 180):
+    """
+    Balances and dense daily net flows of many accounts, each over its own
+    history window. Returns (found ids, balances, history, net, valid), the
+    last three shaped (accounts, history_days); `valid` marks the days from
+    each account's first active day in the window on.
+    """
+    rows = conn.execute(BATCH_HISTORY_SQL, {
+        "account_ids": json.dumps(account_ids),
+        "history_days": history_days,
+    }).fetchall()
+    found = [r["account_id"] for r in rows]
+    balances = np.array([r["balance"] or 0.0 for r in rows], dtype=float)
+    until = np.array([r["until"] or "1970-01-01" for r in rows], dtype="datetime64[D]")
+    history = until.reshape(-1, 1) - np.arange(history_days - 1, -1, -1)
+
+    active = [r for r in rows if r["active_days"]]
+    account = np.repeat(
+        np.array([i for i, r in enumerate(rows) if r["active_days"]], dtype=np.int64),
+        [r["active_days"] for r in active]
+    )
+    position = (history_days - 1) - np.fromstring(",".join(r["ages"] for r in active), dtype=np.int64, sep=",")
+    net = np.zeros((len(rows), history_days))
+    net[account, position] = np.fromstring(",".join(r["nets"] for r in active), sep=",")
+    first = np.full(len(rows), history_days)
+    np.minimum.at(first, account, position)
+    valid = np.arange(history_days)[None, :] >= first[:, None]
+    return found, balances, history, net, valid
+
+
+def parse_float_values(value, name: str):
+    """A number or a list of numbers from a JSON body, as a list."""
+    values = value if isinstance(value, list) else [value]
+    if not values or any(isinstance(v, bool) or not isinstance(v, (int, float)) for v in values):
+        raise ValueError(f"{name} must be a number or a list of numbers")
+    return [float(v) for v in values]
+
+
+def parse_float_list(value: str):
+    return [float(v) for v in value.split(",") if v.strip()]
+
+
+@forecast_bp.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """Hit / miss / eviction counters of the forecast response and model caches."""
+    return jsonify({**forecast_cache_stats(), "models": model_cache_stats()})
+
+
 @forecast_bp.route("/<int:account_id>", methods=["GET"])
 def forecast(account_id: int):
     """
-    Returns sample forecast data for a user's account.
+    Returns forecast data for a user's account, starting from its current
+    balance and a baseline learned from its transaction history.
     Optional query params:
       - days (int): number of forecast days (default=30)
-      - initial_balance (float): starting balance (default=5000)
+      - initial_balance (float): starting balance (default=account balance)
+      - baseline_daily_delta (float): constant daily change (default=from history)
+      - history_days (int): days of history used for the baseline (default=180)
       - cd_apy (float): CD annual interest rate (default=0.035)
       - ai_delta (float): AI daily improvement multiplier (default=0.10)
+      - mode (deterministic|montecarlo|model): default=deterministic
+      - paths (int): simulated paths with mode=montecarlo (default=10000)
+      - seed (int): random seed with mode=montecarlo (default=0)
+      - model (ets|arima|prophet): baseline model with mode=model (default=ets)
+    cd_apy and ai_delta also accept comma-separated lists; the scenarios use
+    the first value and a "grid" with every combination is added.
+    With mode=montecarlo every scenario is a set of percentile bands instead
+    of a single line. With mode=model the baseline is predicted by a
+    statistical model; while it is being fitted the response is 202.
     """
     try:
         days = int(request.args.get("days", 30))
-        initial_balance = float(request.args.get("initial_balance", 5000))
-        cd_apy = float(request.args.get("cd_apy", 0.035))
-        ai_delta = float(request.args.get("ai_delta", 0.10))
-
-        result = generate_sample_forecast(
-            start_date=date.today(),
-            days=days,
-            initial_balance=initial_balance,
-            cd_apy=cd_apy,
-            ai_delta=ai_delta
+        if days <= 0:
+            raise ValueError("days must be positive")
+        history_days = int(request.args.get("history_days", 180))
+        if history_days <= 0:
+            raise ValueError("history_days must be positive")
+        cd_apys = parse_float_list(request.args.get("cd_apy", "0.035"))
+        ai_deltas = parse_float_list(request.args.get("ai_delta", "0.10"))
+        overrides = tuple(
+            (name, float(request.args[name]))
+            for name in ("initial_balance", "baseline_daily_delta")
+            if name in request.args
         )
+        mode = request.args.get("mode", "deterministic")
+        if mode not in ("deterministic", "montecarlo", "model"):
+            raise ValueError("mode must be deterministic, montecarlo or model")
+        simulation = ()
+        if mode == "model":
+            model = request.args.get("model", "ets")
+            if model not in MODELS:
+                raise ValueError(f"model must be one of: {', '.join(MODELS)}")
+            if "baseline_daily_delta" in request.args:
+                raise ValueError("mode=model predicts the baseline from history")
+            simulation = (model,)
+        if mode == "montecarlo":
+            paths = int(request.args.get("paths", MONTECARLO_PATHS))
+            seed = int(request.args.get("seed", 0))
+            if paths <= 0:
+                raise ValueError("paths must be positive")
+            if paths * days > MAX_SIMULATED_DAYS:
+                raise ValueError(f"paths * days must be at most {MAX_SIMULATED_DAYS}")
+            if len(cd_apys) > 1 or len(ai_deltas) > 1:
+                raise ValueError("mode=montecarlo takes a single cd_apy and ai_delta")
+            if "baseline_daily_delta" in request.args:
+                raise ValueError("mode=montecarlo simulates the baseline from history")
+            simulation = (paths, seed)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+    cache_key = forecast_cache_key(get_db(), account_id, (days, history_days, tuple(cd_apys), tuple(ai_deltas), overrides, simulation))
+    body = cached_forecast(cache_key)
+    if body is not None:
+        return Response(body, mimetype="application/json")
+
+    conn = get_db()
+    account = conn.execute("SELECT balance FROM Accounts WHERE id = ?", (account_id,)).fetchone()
+    if not account:
+        return jsonify({"error": "Account not found"}), 404
+
+    try:
+        initial_balance = float(request.args.get("initial_balance", account["balance"] or 0.0))
+        start_date = date.today()
+
+        if mode == "montecarlo":
+            result, summary = montecarlo_forecast(
+                conn, account_id, start_date, days, initial_balance, history_days,
+                cd_apys[0], ai_deltas[0], paths, seed
+            )
+        else:
+            if "baseline_daily_delta" in request.args:
+                baseline = float(request.args["baseline_daily_delta"])
+                summary = {"source": "parameter"}
+            elif mode == "model":
+                baseline, summary = model_baseline(conn, account_id, model, start_date, days, history_days)
+                if baseline is None:
+                    response = jsonify({"status": "fitting", "model": model})
+                    response.headers["Retry-After"] = "1"
+                    return response, 202
+            else:
+                baseline, summary = history_baseline(conn, account_id, start_date, days, history_days)
+                if baseline is None:
+                    baseline, summary = 0.0, {"source": "no_history"}
+
+            result = generate_sample_forecast(
+                start_date=start_date,
+                days=days,
+                initial_balance=initial_balance,
+                baseline_daily_delta=baseline,
+                cd_apy=cd_apys[0],
+                ai_delta=ai_deltas[0]
+            )
+            if len(cd_apys) > 1 or len(ai_deltas) > 1:
+                result["grid"] = {
+                    "cd_apy": cd_apys,
+                    "ai_delta": ai_deltas,
+                    "balances": np.round(scenario_grid(
+                        initial_balance, days, baseline, cd_apys, ai_deltas
+                    ), 2).tolist()
+                }
         result["account_id"] = account_id
-        return jsonify(result)
+        result["initial_balance"] = initial_balance
+        result["baseline"] = summary
+        response = jsonify(result)
+        cache_forecast(cache_key, response.get_data())
+        return response
 
     except Exception as e:
         return jsonify({"error": str(e)}), 400
+
+@forecast_bp.route("/batch", methods=["POST"])
+def forecast_batch():
+    """
+    Forecasts many accounts over a grid of scenarios in one request.
+    JSON body:
+      - account_ids (list of int): accounts to forecast (required)
+      - days (int): number of forecast days (default=30)
+      - history_days (int): days of history used for the baselines (default=180)
+      - cd_apy (float or list): CD annual interest rates (default=0.035)
+      - ai_delta (float or list): AI daily improvement multipliers (default=0.10)
+    Returns "balances" shaped (accounts, cd_apy, ai_delta, days), in the
+    order of "account_ids"; unknown ids are listed under "missing".
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        account_ids = data.get("account_ids")
+        if not isinstance(account_ids, list) or not account_ids \
+                or any(isinstance(i, bool) or not isinstance(i, int) for i in account_ids):
+            raise ValueError("account_ids must be a non-empty list of integers")
+        account_ids = list(dict.fromkeys(account_ids))
+        if len(account_ids) > MAX_BATCH_ACCOUNTS:
+            raise ValueError(f"at most {MAX_BATCH_ACCOUNTS} accounts per batch")
+        days = int(data.get("days", 30))
+        if days <= 0:
+            raise ValueError("days must be positive")
+        history_days = int(data.get("history_days", 180))
+        if history_days <= 0:
+            raise ValueError("history_days must be positive")
+        cd_apys = parse_float_values(data.get("cd_apy", 0.035), "cd_apy")
+        ai_deltas = parse_float_values(data.get("ai_delta", 0.10), "ai_delta")
+        if len(account_ids) * len(cd_apys) * len(ai_deltas) * days > MAX_BATCH_VALUES:
+            raise ValueError(f"accounts * cd_apy * ai_delta * days must be at most {MAX_BATCH_VALUES}")
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+    conn = get_db()
+    start_date = date.today()
+    found, balances, history, net, valid = batch_history(conn, account_ids, history_days)
+    position = {account_id: i for i, account_id in enumerate(found)}
+    kept = [i for i in account_ids if i in position]
+    order = [position[i] for i in kept]
+    balances, history, net, valid = balances[order], history[order], net[order], valid[order]
+
+    deltas, mean = profile_deltas(history, net, valid, start_date, days)
+    rates = np.asarray(cd_apys, dtype=float) / 365.0
+    scales = 1.0 + np.asarray(ai_deltas, dtype=float)
+    tensor = project_balances(
+        balances[:, None, None],
+        deltas[:, None, None, :] * scales[None, None, :, None],
+        rates[None, :, None],
+        days,
+        per_day=True,
+    )
+
+    has_history = valid.any(axis=1)
+    return jsonify({
+        "dates": forecast_dates(start_date, days),
+        "cd_apy": cd_apys,
+        "ai_delta": ai_deltas,
+        "account_ids": kept,
+        "missing": [i for i in account_ids if i not in position],
+        "initial_balances": balances.tolist(),
+        "avg_daily_net": [round(float(m), 2) if h else None for m, h in zip(mean, has_history)],
+        "balances": np.round(tensor, 2).tolist(),
+    })
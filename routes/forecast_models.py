@@ -0,0 +1,131 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import hashlib
+import multiprocessing
+import threading
+
+import numpy as np
+from cachetools import LRUCache
+from flask import current_app
+
+# ------------------------------------------------------
+# Statistical forecast models
+# ------------------------------------------------------
+#
+# ETS, ARIMA and (when installed) Prophet, fitted to an account's daily net
+# flows. A fit takes from a fraction of a second to several seconds, so it
+# runs in a process pool: the request waits up to FORECAST_MODEL_WAIT
+# seconds for it and is otherwise told to come back. Fitted models are kept
+# per worker process, keyed by account, model, history window and a digest
+# of the daily net flows they were fitted to, so an account is refit once
+# any transaction in its window is added, edited or deleted, and only then.
+# statsmodels, pandas and prophet are imported on first use.
+
+MODELS = ("ets", "arima", "prophet")
+MODEL_CACHE_SIZE = 256
+SEASON = 7  # days; weekly seasonality
+MIN_HISTORY_DAYS = 2 * SEASON
+
+_models = LRUCache(MODEL_CACHE_SIZE)
+_fitting = {}  # key -> Future of a fit in progress
+_stats = {"hits": 0, "fits": 0, "failures": 0}
+# Reentrant: a done callback may run right away in the thread adding it
+_models_lock = threading.RLock()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def fit_ets(net, first_day):
+    from statsmodels.tsa.holtwinters import ExponentialSmoothing
+    return ExponentialSmoothing(
+        net, trend="add", damped_trend=True, seasonal="add", seasonal_periods=SEASON
+    ).fit()
+
+def fit_arima(net, first_day):
+    from statsmodels.tsa.arima.model import ARIMA
+    return ARIMA(net, order=(1, 0, 1), seasonal_order=(1, 0, 0, SEASON), trend="c").fit()
+
+def fit_prophet(net, first_day):
+    import pandas as pd
+    from prophet import Prophet
+    model = Prophet(daily_seasonality=False, yearly_seasonality=False)
+    model.add_seasonality(name="monthly", period=30.5, fourier_order=5)
+    return model.fit(pd.DataFrame({"ds": pd.date_range(first_day, periods=len(net), freq="D"), "y": net}))
+
+FITTERS = {"ets": fit_ets, "arima": fit_arima, "prophet": fit_prophet}
+
+def fit_model(model, net, first_day):
+    """Runs in a pool process; the fitted model is pickled back."""
+    return FITTERS[model](net, first_day)
+
+def model_pool():
+    """The process pool, started on first use (after any server fork)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=current_app.config.get("FORECAST_MODEL_WORKERS", 1),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+def reset_pool():
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+def _fit_done(key, future):
+    with _models_lock:
+        _fitting.pop(key, None)
+        if not future.cancelled() and future.exception() is None:
+            _models[key] = future.result()
+            _stats["fits"] += 1
+        else:
+            _stats["failures"] += 1
+
+def history_digest(history, net):
+    """Identifies a daily net flow series, dates included."""
+    return hashlib.blake2b(str(history[0]).encode() + np.ascontiguousarray(net, dtype=float).tobytes(),
+                           digest_size=16).hexdigest()
+
+def fitted_model(model, account_id, history_days, history, net, wait):
+    """
+    The model fitted to this history of the account, or None if the fit is
+    still running after `wait` seconds. Raises the fit's exception if it
+    failed.
+    """
+    key = (account_id, model, history_days, history_digest(history, net))
+    with _models_lock:
+        fitted = _models.get(key)
+        if fitted is not None:
+            _stats["hits"] += 1
+            return fitted
+        future = _fitting.get(key)
+        if future is None:
+            future = model_pool().submit(fit_model, model, net, str(history[0]))
+            _fitting[key] = future
+            future.add_done_callback(lambda done: _fit_done(key, done))
+    try:
+        return future.result(timeout=wait)
+    except TimeoutError:
+        return None
+    except BrokenProcessPool:
+        reset_pool()
+        raise
+
+def model_deltas(model, fitted, until, start_date, days):
+    """
+    Per-day net flows predicted for the `days` days after `start_date`,
+    continuing from the last day of history `until`.
+    """
+    first_day = np.datetime64(start_date, "D") + 1
+    if model == "prophet":
+        import pandas as pd
+        future = pd.DataFrame({"ds": pd.date_range(str(first_day), periods=days, freq="D")})
+        return fitted.predict(future)["yhat"].to_numpy()
+    gap = max(int((first_day - until).astype(np.int64)) - 1, 0)
+    return np.asarray(fitted.forecast(gap + days))[gap:]
+
+def model_cache_stats():
+    with _models_lock:
+        return {**_stats, "size": len(_models), "maxsize": _models.maxsize, "fitting": len(_fitting)}
@@ -0,0 +1,120 @@
+from flask import Blueprint, jsonify, request
+from datetime import datetime
+
+from db.connection import get_db, run_write
+from db.create import ADJUSTMENTS, MANUAL_ADJUSTMENT, OPENING_AMOUNT
+from routes.events import publish_goals
+from routes.projection import requested_fields, response_format, select_list, serialize, table_columns
+
+goal_transactions_bp = Blueprint('goal_transactions', __name__)
+
+# Goals.CurrentAmount, ContributionCount and LastContributionAt follow these
+# rows through triggers (migration 5): 'IN' adds to the goal, 'OUT' takes
+# from it. Rows booked by record_adjustment (ADJUSTMENTS) move CurrentAmount
+# but do not count as contributions.
+TYPES = ("IN", "OUT")
+
+def record_adjustment(conn, goal_id, user_id, delta, description):
+    """Books `delta` on a goal as an IN or OUT row, inside the caller's transaction."""
+    if round(delta, 2) == 0:
+        return
+    conn.execute("""
+        INSERT INTO GoalTransactions (GoalId, UserId, Type, Amount, Description)
+        VALUES (?, ?, ?, ?, ?)
+    """, (goal_id, user_id, "IN" if delta > 0 else "OUT", round(abs(delta), 2), description))
+
+def parse_fields(data, partial=False):
+    """Validated column values from a request body; raises ValueError."""
+    values = {}
+    if "Type" in data or not partial:
+        if data.get("Type") not in TYPES:
+            raise ValueError(f"Type must be one of: {', '.join(TYPES)}")
+        values["Type"] = data["Type"]
+    if "Amount" in data or not partial:
+        amount = data.get("Amount")
+        if isinstance(amount, bool) or not isinstance(amount, (int, float)) or amount <= 0:
+            raise ValueError("Amount must be a positive number")
+        values["Amount"] = round(float(amount), 2)
+    if "Description" in data:
+        values["Description"] = data["Description"]
+    if "CreatedAt" in data:
+        # Normalized so rows compare chronologically as text
+        values["CreatedAt"] = datetime.fromisoformat(str(data["CreatedAt"])).strftime("%Y-%m-%d %H:%M:%S")
+    return values
+
+# --- GET ---
+@goal_transactions_bp.route('/goal/<int:goal_id>', methods=['GET'])
+def get_goal_transactions(goal_id):
+    """Ledger of a goal, newest first."""
+    conn = get_db()
+    try:
+        fields = requested_fields(table_columns(conn, "GoalTransactions"))
+        fmt = response_format()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rows = conn.execute(f"""
+        SELECT {select_list(fields)} FROM GoalTransactions
+        WHERE GoalId = ? ORDER BY CreatedAt DESC, TransactionId DESC
+    """, (goal_id,)).fetchall()
+    return jsonify(serialize(rows, fields, fmt))
+
+@goal_transactions_bp.route('/<int:transaction_id>', methods=['GET'])
+def get_goal_transaction(transaction_id):
+    conn = get_db()
+    row = conn.execute("SELECT * FROM GoalTransactions WHERE TransactionId = ?", (transaction_id,)).fetchone()
+    if not row:
+        return jsonify({"error": "Goal transaction not found"}), 404
+    return jsonify(dict(row))
+
+# --- POST ---
+@goal_transactions_bp.route('/', methods=['POST'])
+def add_goal_transaction():
+    data = request.get_json()
+    try:
+        values = parse_fields(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def write(conn):
+        goal = conn.execute("SELECT UserId FROM Goals WHERE GoalId = ?", (data.get("GoalId"),)).fetchone()
+        if not goal:
+            return None
+        # The owner always comes from the goal
+        values.update(GoalId=data["GoalId"], UserId=goal["UserId"])
+        return conn.execute(
+            f"INSERT INTO GoalTransactions ({', '.join(values)}) VALUES ({', '.join('?' * len(values))})",
+            list(values.values())
+        ).lastrowid
+
+    transaction_id = run_write(write)
+    if transaction_id is None:
+        return jsonify({"error": "Goal not found"}), 404
+    publish_goals(get_db(), [(data["GoalId"], values["UserId"])])
+    return jsonify({"message": "Goal transaction added", "id": transaction_id}), 201
+
+# --- PATCH ---
+@goal_transactions_bp.route('/<int:transaction_id>', methods=['PATCH'])
+def update_goal_transaction(transaction_id):
+    data = request.get_json()
+    try:
+        values = parse_fields(data, partial=True)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not values:
+        return jsonify({"error": "No fields to update"}), 400
+    changed = run_write(lambda conn: conn.execute(
+        f"UPDATE GoalTransactions SET {', '.join(f'{k} = ?' for k in values)} WHERE TransactionId = ? "
+        "RETURNING GoalId, UserId",
+        [*values.values(), transaction_id]
+    ).fetchall())
+    publish_goals(get_db(), changed)
+    return jsonify({"message": "Goal transaction updated"})
+
+# --- DELETE ---
+@goal_transactions_bp.route('/<int:transaction_id>', methods=['DELETE'])
+def delete_goal_transaction(transaction_id):
+    changed = run_write(lambda conn: conn.execute(
+        "DELETE FROM GoalTransactions WHERE TransactionId = ? RETURNING GoalId, UserId", (transaction_id,)
+    ).fetchall())
+    publish_goals(get_db(), changed)
+    return jsonify({"message": "Goal transaction deleted"})
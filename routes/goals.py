@@ -1,29 +1,84 @@
 from flask import Blueprint, jsonify, request
 import sqlite3
 
+from db.connection import get_db, run_write
+from db.create import ADJUSTMENTS, MANUAL_ADJUSTMENT, OPENING_AMOUNT
+from routes.etags import conditional
+from routes.events import publish, publish_goals
+from routes.goal_transactions import record_adjustment
+from routes.projection import requested_fields, response_format, select_list, serialize, table_columns
+
 goals_bp = Blueprint('goals', __name__)
 
-DB_PATH = "db/goalflow.db"
+# Derived columns of GET /goals/account/<id>. The projection assumes the goal
+# keeps growing at the average rate of its contributions so far (first to last
+# contribution), so it only changes when the goal's data does. Opening amounts
+# and manual adjustments are not growth, so they are left out of the rate.
+PROGRESS_FIELDS = {
+    "ProgressPct": """
+        CASE WHEN TargetAmount > 0
+        THEN ROUND(100.0 * IFNULL(CurrentAmount, 0) / TargetAmount, 1) END""",
+    "ProjectedCompletionDate": """
+        CASE
+            WHEN IFNULL(CurrentAmount, 0) >= TargetAmount THEN date(LastContributionAt)
+            WHEN IFNULL(rate.contributions, 0) < 2 OR rate.amount <= 0 THEN NULL
+            ELSE date(rate.last, '+' || CAST(0.999 + (TargetAmount - IFNULL(CurrentAmount, 0))
+                * rate.contributions / (rate.amount * (rate.contributions - 1))
+                * MAX(1, julianday(rate.last) - julianday(rate.first)) AS INTEGER) || ' days')
+        END""",
+}
+
+# Contributions of an account's goals behind the projection's rate
+CONTRIBUTION_RATE_SQL = f"""
+    SELECT GoalId AS goal,
+           SUM(Type IS NOT 'OUT') AS contributions,
+           SUM(CASE Type WHEN 'OUT' THEN -Amount ELSE Amount END) AS amount,
+           MIN(CASE WHEN Type IS NOT 'OUT' THEN CreatedAt END) AS first,
+           MAX(CASE WHEN Type IS NOT 'OUT' THEN CreatedAt END) AS last
+    FROM GoalTransactions
+    WHERE GoalId IN (SELECT GoalId FROM Goals WHERE UserId = :account)
+      AND IFNULL(Description, '') NOT IN ({", ".join(f"'{d}'" for d in ADJUSTMENTS)})
+    GROUP BY GoalId
+"""
 
 @goals_bp.route('/', methods=['GET'])
+@conditional("Goals")
 def get_goals():
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.row_factory = sqlite3.Row
-        rows = conn.execute("SELECT * FROM Goals").fetchall()
-    return jsonify([dict(row) for row in rows])
+    conn = get_db()
+    try:
+        fields = requested_fields(table_columns(conn, "Goals"))
+        fmt = response_format()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rows = conn.execute(f"SELECT {select_list(fields)} FROM Goals").fetchall()
+    return jsonify(serialize(rows, fields, fmt))
 
 @goals_bp.route('/account/<int:account_id>', methods=['GET'])
+@conditional("Goals:{account_id}")
 def get_account_goals(account_id):
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.row_factory  = sqlite3.Row
-        rows = conn.execute("SELECT * FROM Goals WHERE UserId = ?", (account_id,)).fetchall()
-    return jsonify([dict(row) for row in rows])
+    """
+    Goals of an account with their progress: ProgressPct of the target
+    reached and ProjectedCompletionDate (null until the goal has two
+    contributions).
+    """
+    conn = get_db()
+    try:
+        fields = requested_fields((*table_columns(conn, "Goals"), *PROGRESS_FIELDS))
+        fmt = response_format()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    columns = ", ".join(f"{PROGRESS_FIELDS[f]} AS {f}" if f in PROGRESS_FIELDS else f for f in fields)
+    rows = conn.execute(f"""
+        SELECT {columns} FROM Goals LEFT JOIN ({CONTRIBUTION_RATE_SQL}) AS rate ON rate.goal = GoalId
+        WHERE UserId = :account
+    """, {"account": account_id}).fetchall()
+    return jsonify(serialize(rows, fields, fmt))
 
 @goals_bp.route('/<int:goal_id>', methods=['GET'])
+@conditional("Goals")
 def get_goal(goal_id):
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.row_factory = sqlite3.Row
-        row = conn.execute("SELECT * FROM Goals WHERE GoalId = ?", (goal_id,)).fetchone()
+    conn = get_db()
+    row = conn.execute("SELECT * FROM Goals WHERE GoalId = ?", (goal_id,)).fetchone()
     if not row:
         return jsonify({"error": "Goal not found"}), 404
     return jsonify(dict(row))
@@ -31,21 +86,27 @@ def get_goal(goal_id):
 @goals_bp.route('/', methods=['POST'])
 def add_goal():
     data = request.get_json()
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("PRAGMA journal_mode=WAL;")
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO Goals (UserId, GoalName, Description, TargetAmount, CurrentAmount, Deadline)
-            VALUES (?, ?, ?, ?, ?, ?)
+
+    def write(conn):
+        cur = conn.execute("""
+            INSERT INTO Goals (UserId, GoalName, Description, TargetAmount, Deadline)
+            VALUES (?, ?, ?, ?, ?)
         """, (
             data["UserId"],
             data["GoalName"],
             data.get("Description", ""),
             data["TargetAmount"],
-            data.get("CurrentAmount", 0.0),
             data.get("Deadline")
         ))
-        conn.commit()
+        # A starting amount is booked on the goal's ledger like any contribution
+        record_adjustment(conn, cur.lastrowid, data["UserId"], data.get("CurrentAmount", 0.0), OPENING_AMOUNT)
+        return cur.lastrowid
+
+    try:
+        goal_id = run_write(write)
+    except sqlite3.IntegrityError as e:
+        return jsonify({"error": str(e)}), 400
+    publish_goals(get_db(), [(goal_id, data["UserId"])])
     return jsonify({"message": "Goal added"}), 201
 
 @goals_bp.route('/<int:goal_id>', methods=['PATCH'])
@@ -53,22 +114,35 @@ def update_goal(goal_id):
     data = request.get_json()
     fields = []
     values = []
-    for f in ["GoalName", "Description", "TargetAmount", "CurrentAmount", "Deadline", "IsCompleted"]:
+    for f in ["GoalName", "Description", "TargetAmount", "Deadline", "IsCompleted"]:
         if f in data:
             fields.append(f"{f} = ?")
             values.append(data[f])
-    if not fields:
+    if not fields and "CurrentAmount" not in data:
         return jsonify({"error": "No fields to update"}), 400
     values.append(goal_id)
-    with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cur.execute(f"UPDATE Goals SET {', '.join(fields)} WHERE GoalId = ?", values)
-        conn.commit()
+
+    def write(conn):
+        if fields:
+            conn.execute(f"UPDATE Goals SET {', '.join(fields)} WHERE GoalId = ?", values)
+        # CurrentAmount follows the ledger: a new value is booked as the difference
+        goal = conn.execute("SELECT UserId, CurrentAmount FROM Goals WHERE GoalId = ?", (goal_id,)).fetchone()
+        if goal and "CurrentAmount" in data:
+            record_adjustment(conn, goal_id, goal["UserId"], data["CurrentAmount"] - (goal["CurrentAmount"] or 0.0),
+                              MANUAL_ADJUSTMENT)
+        return goal
+
+    try:
+        goal = run_write(write)
+    except sqlite3.IntegrityError as e:
+        return jsonify({"error": str(e)}), 400
+    if goal:
+        publish_goals(get_db(), [(goal_id, goal["UserId"])])
     return jsonify({"message": "Goal updated"})
 
 @goals_bp.route('/<int:goal_id>', methods=['DELETE'])
 def delete_goal(goal_id):
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("DELETE FROM Goals WHERE GoalId = ?", (goal_id,))
-        conn.commit()
+    goal = run_write(lambda conn: conn.execute("DELETE FROM Goals WHERE GoalId = ? RETURNING UserId", (goal_id,)).fetchone())
+    if goal:
+        publish(goal["UserId"], "goal", {"GoalId": goal_id, "UserId": goal["UserId"], "deleted": True})
     return jsonify({"message": "Goal deleted"})
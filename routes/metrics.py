@@ -0,0 +1,163 @@
+import logging
+import re
+import threading
+import time
+
+from flask import Blueprint, Response, current_app, g, has_request_context, request
+
+from db import connection
+
+# ------------------------------------------------------
+# Request and SQL instrumentation, exported at /metrics
+# ------------------------------------------------------
+#
+# Every request is timed from before_request until its response is closed
+# (so streamed bodies are included) and labelled with its URL rule, not its
+# path, to keep the number of series bounded. Statements run on pooled
+# connections are counted and timed through the connection layer's statement
+# observer and charged to the request that ran them; with WRITE_QUEUE that
+# includes its write, run on the writer thread, together with the BEGIN and
+# COMMIT of the group it was committed in. Everything is kept in
+# process memory and rendered in the Prometheus text format; with several
+# worker processes each one reports its own numbers.
+
+# Seconds; the last bucket (+Inf) is implicit
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)
+
+slow_query_log = logging.getLogger("goalflow.slow_queries")
+
+metrics_bp = Blueprint("metrics", __name__)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=""):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{_labels(self.labels, labels)} {value}"
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self.values = {}    # labels -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, value, labels=()):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        else:
+            series[len(self.buckets)] += 1
+        series[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, labels)} {series[-1]}"
+            yield f"{self.name}_count{_labels(self.labels, labels)} {cumulative}"
+
+_lock = threading.Lock()
+
+REQUEST_LATENCY = Histogram(
+    "goalflow_http_request_duration_seconds", "Time from request start until the response is closed.",
+    ("method", "route", "status"))
+REQUEST_SQL_TIME = Histogram(
+    "goalflow_http_request_sql_seconds", "SQLite time spent per request.",
+    ("method", "route"))
+REQUEST_QUERIES = Histogram(
+    "goalflow_http_request_sql_queries", "SQL statements run per request.",
+    ("method", "route"), QUERY_COUNT_BUCKETS)
+SQL_QUERIES = Counter(
+    "goalflow_sql_queries_total", "SQL statements run.", ("route",))
+SQL_SECONDS = Counter(
+    "goalflow_sql_seconds_total", "SQLite time spent in statements.", ("route",))
+SLOW_QUERIES = Counter(
+    "goalflow_sql_slow_queries_total", "Statements slower than SLOW_QUERY_MS.", ("route",))
+
+METRICS = (REQUEST_LATENCY, REQUEST_SQL_TIME, REQUEST_QUERIES, SQL_QUERIES, SQL_SECONDS, SLOW_QUERIES)
+
+def route_label():
+    """The URL rule of the current request; unmatched paths share one label."""
+    return request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+
+def observe_statement(sql, seconds):
+    """Statement observer: charges the statement to the current request."""
+    if not has_request_context() or "request_stats" not in g:
+        return
+    stats = g.request_stats
+    stats["queries"] += 1
+    stats["sql_seconds"] += seconds
+
+    threshold = current_app.config.get("SLOW_QUERY_MS")
+    if threshold is not None and seconds * 1000 >= threshold:
+        stats["slow_queries"] += 1
+        slow_query_log.warning(
+            "%.1f ms %s %s: %s", seconds * 1000, request.method, route_label(),
+            re.sub(r"\s+", " ", sql).strip()[:500]
+        )
+
+def start_request():
+    g.request_stats = {"start": time.perf_counter(), "queries": 0, "sql_seconds": 0.0, "slow_queries": 0}
+
+def finish_request(response):
+    stats = g.get("request_stats")
+    if stats is None:
+        return response
+    method, route, status = request.method, route_label(), str(response.status_code)
+    response.headers["Server-Timing"] = f'sql;dur={stats["sql_seconds"] * 1000:.2f};desc="{stats["queries"]} queries"'
+
+    def record():
+        # Runs once the body has been sent; streamed rows are fetched until then
+        elapsed = time.perf_counter() - stats["start"]
+        with _lock:
+            REQUEST_LATENCY.observe(elapsed, (method, route, status))
+            REQUEST_SQL_TIME.observe(stats["sql_seconds"], (method, route))
+            REQUEST_QUERIES.observe(stats["queries"], (method, route))
+            SQL_QUERIES.inc((route,), stats["queries"])
+            SQL_SECONDS.inc((route,), stats["sql_seconds"])
+            if stats["slow_queries"]:
+                SLOW_QUERIES.inc((route,), stats["slow_queries"])
+
+    response.call_on_close(record)
+    return response
+
+def render_metrics():
+    with _lock:
+        lines = [line for metric in METRICS for line in metric.render()]
+    return "\n".join(lines) + "\n"
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+def init_app(app):
+    app.config.setdefault("SLOW_QUERY_MS", None)
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.register_blueprint(metrics_bp)
+    connection.set_statement_observer(observe_statement)
@@ -1,22 +1,32 @@
 from flask import Blueprint, jsonify, request
 import sqlite3
+from datetime import date
 
-missions_bp = Blueprint('missions', __name__)
+from db.connection import get_db, run_write
+from db.missions import evaluate_missions, generate_weekly_missions
+from routes.etags import conditional
+from routes.events import publish_missions
+from routes.projection import requested_fields, response_format, select_list, serialize, table_columns
 
-DB_PATH = "db/goalflow.db"
+missions_bp = Blueprint('missions', __name__)
 
 @missions_bp.route('/', methods=['GET'])
+@conditional("WeeklyMissions")
 def get_all_missions():
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.row_factory = sqlite3.Row
-        rows = conn.execute("SELECT * FROM WeeklyMissions").fetchall()
-    return jsonify([dict(row) for row in rows])
+    conn = get_db()
+    try:
+        fields = requested_fields(table_columns(conn, "WeeklyMissions"))
+        fmt = response_format()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rows = conn.execute(f"SELECT {select_list(fields)} FROM WeeklyMissions").fetchall()
+    return jsonify(serialize(rows, fields, fmt))
 
 @missions_bp.route('/<int:mission_id>', methods=['GET'])
+@conditional("WeeklyMissions")
 def get_mission(mission_id):
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.row_factory = sqlite3.Row
-        row = conn.execute("SELECT * FROM WeeklyMissions WHERE MissionId = ?", (mission_id,)).fetchone()
+    conn = get_db()
+    row = conn.execute("SELECT * FROM WeeklyMissions WHERE MissionId = ?", (mission_id,)).fetchone()
     if not row:
         return jsonify({"error": "Mission not found"}), 404
     return jsonify(dict(row))
@@ -24,9 +34,8 @@ def get_mission(mission_id):
 @missions_bp.route('/', methods=['POST'])
 def add_mission():
     data = request.get_json()
-    with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cur.execute("""
+    try:
+        run_write(lambda conn: conn.execute("""
             INSERT INTO WeeklyMissions (UserId, GoalId, TemplateId, Title, Description, Type, TargetAmount, Deadline)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         """, (
@@ -38,10 +47,39 @@ def add_mission():
             data.get("Type", "SAVE"),
             data.get("TargetAmount", 0),
             data["Deadline"]
-        ))
-        conn.commit()
+        )))
+    except sqlite3.IntegrityError as e:
+        return jsonify({"error": str(e)}), 400
     return jsonify({"message": "Mission created"}), 201
 
+@missions_bp.route('/evaluate', methods=['POST'])
+def evaluate():
+    """
+    Completes every open mission whose goal is met (see db/missions.py).
+    Only missions affected since the previous run are checked unless
+    ?full=1 is given.
+    """
+    full = request.args.get("full", "0") in ("1", "true")
+    completions = []
+    completed = run_write(lambda conn: evaluate_missions(conn, full=full, completions=completions))
+    publish_missions(get_db(), completions)
+    return jsonify({"full": full, "completed": completed})
+
+@missions_bp.route('/generate', methods=['POST'])
+def generate():
+    """
+    Creates this week's missions from MissionTemplates for every open goal
+    that has none yet; running it again in the same week adds nothing.
+    Optional query params:
+      - week (YYYY-MM-DD): any day of the week to generate instead
+    """
+    try:
+        day = date.fromisoformat(request.args["week"]) if "week" in request.args else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    week, created = run_write(lambda conn: generate_weekly_missions(conn, day))
+    return jsonify({"week": week, "created": created}), 201 if created else 200
+
 @missions_bp.route('/<int:mission_id>', methods=['PATCH'])
 def update_mission(mission_id):
     data = request.get_json()
@@ -54,15 +92,16 @@ def update_mission(mission_id):
     if not fields:
         return jsonify({"error": "No fields to update"}), 400
     values.append(mission_id)
-    with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cur.execute(f"UPDATE WeeklyMissions SET {', '.join(fields)} WHERE MissionId = ?", values)
-        conn.commit()
+    try:
+        changed = run_write(lambda conn: conn.execute(
+            f"UPDATE WeeklyMissions SET {', '.join(fields)} WHERE MissionId = ? RETURNING MissionId, UserId", values
+        ).fetchall())
+    except sqlite3.IntegrityError as e:
+        return jsonify({"error": str(e)}), 400
+    publish_missions(get_db(), changed)
     return jsonify({"message": "Mission updated"})
 
 @missions_bp.route('/<int:mission_id>', methods=['DELETE'])
 def delete_mission(mission_id):
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("DELETE FROM WeeklyMissions WHERE MissionId = ?", (mission_id,))
-        conn.commit()
+    run_write(lambda conn: conn.execute("DELETE FROM WeeklyMissions WHERE MissionId = ?", (mission_id,)))
     return jsonify({"message": "Mission deleted"})
@@ -0,0 +1,61 @@
+from flask import request
+
+# ------------------------------------------------------
+# Sparse fields and columnar output for list endpoints
+# ------------------------------------------------------
+#
+# ?fields=a,b is validated against the table's columns and pushed down into
+# the SELECT, so unneeded columns are never read or serialized.
+# ?format=columnar returns {column: [values, ...]} instead of a list of
+# objects, which stops large responses from repeating every column name on
+# every row.
+
+FORMATS = ("rows", "columnar")
+
+_table_columns = {}
+
+def table_columns(conn, table):
+    """Column names of `table`, read once per process."""
+    columns = _table_columns.get(table)
+    if columns is None:
+        columns = _table_columns[table] = tuple(
+            row[1] for row in conn.execute(f"PRAGMA table_info({table})")
+        )
+    return columns
+
+def requested_fields(available):
+    """
+    The columns asked for with ?fields= (all of `available` when absent), in
+    the requested order. Raises ValueError on unknown names.
+    """
+    fields = request.args.get("fields")
+    if not fields:
+        return list(available)
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in names if f not in available]
+    if unknown or not names:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}" if unknown else "fields is empty")
+    return list(dict.fromkeys(names))
+
+def select_list(fields, required=()):
+    """
+    SQL column list for `fields`, plus any `required` columns the query
+    itself needs (e.g. for cursors); those are dropped again by serialize().
+    """
+    return ", ".join([*fields, *(c for c in required if c not in fields)])
+
+def response_format():
+    fmt = request.args.get("format", "rows")
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+    return fmt
+
+def serialize(rows, fields, fmt="rows"):
+    """Rows as a list of objects, or as columns, limited to `fields`."""
+    if fmt == "columnar":
+        columns = {f: [] for f in fields}
+        for row in rows:
+            for f in fields:
+                columns[f].append(row[f])
+        return columns
+    return [{f: row[f] for f in fields} for row in rows]
@@ -1,40 +1,187 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+import base64
+import json
+import math
 import sqlite3
-from datetime import datetime
+from datetime import date, datetime, timedelta
+
+from db.connection import get_db, run_write
+from db.rollups import record_flow, record_flows, record_spending, record_spendings
+from routes.events import publish_balances
+from routes.projection import requested_fields, response_format, select_list, serialize, table_columns
 
 transactions_bp = Blueprint('transactions', __name__)
 
-DB_PATH = "db/goalflow.db"
+# Format of Transactions.datetime: SQLite's date() parses it, and rows
+# compare chronologically as text (keyset cursors, from/to filters)
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Keyset pagination for GET /transactions/
+MAX_PAGE_SIZE = 10000
+STREAM_THRESHOLD = 500  # pages bigger than this are streamed
+FETCH_SIZE = 500        # rows pulled per fetchmany() while streaming
+
+# Bulk ingestion for POST /transactions/batch
+MAX_BATCH_SIZE = 100000
+BATCH_CHUNK_SIZE = 1000  # rows per executemany() call
+
+def encode_cursor(row):
+    raw = f"{row['datetime']}|{row['id']}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(cursor):
+    try:
+        dt, tid = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return dt, int(tid)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+def stream_rows(cur, fields, limit=None):
+    """
+    Yields a JSON document built from `cur` with fetchmany(), so rows are
+    never all held in memory. Without a limit the document is a plain array;
+    with one, it is a page envelope whose next_cursor is set when the cursor
+    produced an extra (limit + 1) row. Only `fields` are written out.
+    """
+    yield "[" if limit is None else '{"transactions": ['
+    count, last, has_more = 0, None, False
+    while not has_more:
+        rows = cur.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        for row in rows:
+            if count == limit:
+                has_more = True
+                break
+            yield ("," if count else "") + json.dumps({f: row[f] for f in fields})
+            count, last = count + 1, row
+    if limit is None:
+        yield "]"
+    else:
+        next_cursor = encode_cursor(last) if has_more else None
+        yield f'], "next_cursor": {json.dumps(next_cursor)}}}'
+
+def update_balance(conn, account_id, delta):
+    """Applies `delta` to an account inside the caller's transaction."""
+    conn.execute("UPDATE Accounts SET balance = balance + ? WHERE id = ?", (delta, account_id))
 
-def update_balance(account_id, delta):
-    with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cur.execute("UPDATE Accounts SET balance = balance + ? WHERE id = ?", (delta, account_id))
-        conn.commit()
+def apply_flow(conn, account_id, when, inflow=0.0, outflow=0.0):
+    """Books a flow on the account's daily rollup and balance."""
+    record_flow(conn, account_id, when, inflow, outflow)
+    update_balance(conn, account_id, inflow - outflow)
 
 @transactions_bp.route('/', methods=['GET'])
 def get_all_transactions():
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.row_factory = sqlite3.Row
-        rows = conn.execute("SELECT * FROM Transactions ORDER BY datetime DESC").fetchall()
-    return jsonify([dict(row) for row in rows])
+    """
+    Lists transactions newest first.
+    Optional query params:
+      - limit (int): page size, enables pagination (default=100 when `after` is given)
+      - after (str): next_cursor of the previous page
+      - fields (str): comma-separated columns to return (default=all)
+      - format (str): "rows" (default) or "columnar"
+    Without limit / after the full list is returned as a plain array
+    (streamed, unless columnar).
+    """
+    conn = get_db()
+    try:
+        fields = requested_fields(table_columns(conn, "Transactions"))
+        fmt = response_format()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # The keyset cursor needs datetime and id even when not requested
+    columns = select_list(fields, required=("datetime", "id"))
+
+    if "limit" not in request.args and "after" not in request.args:
+        cur = conn.execute(f"SELECT {columns} FROM Transactions ORDER BY datetime DESC, id DESC")
+        if fmt == "columnar":
+            return jsonify(serialize(cur, fields, fmt))
+        return Response(stream_with_context(stream_rows(cur, fields)), mimetype="application/json")
+
+    try:
+        limit = int(request.args.get("limit", 100))
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        after = request.args.get("after")
+        if after:
+            where, params = "WHERE (datetime, id) < (?, ?)", [*decode_cursor(after)]
+        else:
+            where, params = "", []
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # One extra row tells us whether there is a next page
+    cur = conn.execute(f"""
+        SELECT {columns} FROM Transactions {where}
+        ORDER BY datetime DESC, id DESC
+        LIMIT ?
+    """, (*params, limit + 1))
+
+    if limit > STREAM_THRESHOLD and fmt == "rows":
+        return Response(stream_with_context(stream_rows(cur, fields, limit)), mimetype="application/json")
+
+    rows = cur.fetchall()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return jsonify({
+        "transactions": serialize(rows[:limit], fields, fmt),
+        "next_cursor": next_cursor
+    })
 
 @transactions_bp.route('/account/<int:account_id>', methods=['GET'])
 def get_account_transactions(account_id):
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.row_factory  = sqlite3.Row
-        rows = conn.execute("""SELECT * FROM Transactions 
-                            WHERE destination_account = ?""", (account_id,)).fetchall()
-        rows2 = conn.execute("""SELECT * FROM Transactions 
-                            WHERE origin_account = ?""", (account_id,)).fetchall()
-        rows = rows + rows2
-    return jsonify([dict(row) for row in rows])
+    """
+    Lists an account's transactions newest first, each tagged with its
+    direction for this account ('IN' / 'OUT') and a signed net_amount.
+    Optional query params:
+      - from (YYYY-MM-DD): first day included
+      - to (YYYY-MM-DD): last day included
+      - business_type (str): only this category
+      - limit (int): maximum number of rows
+      - fields (str): comma-separated columns to return (default=all)
+      - format (str): "rows" (default) or "columnar"
+    """
+    conn = get_db()
+    filters, params = [], []
+    try:
+        fields = requested_fields((*table_columns(conn, "Transactions"), "direction", "net_amount"))
+        fmt = response_format()
+        if request.args.get("from"):
+            filters.append("datetime >= ?")
+            params.append(date.fromisoformat(request.args["from"]).isoformat())
+        if request.args.get("to"):
+            filters.append("datetime < ?")
+            params.append((date.fromisoformat(request.args["to"]) + timedelta(days=1)).isoformat())
+        if request.args.get("business_type"):
+            filters.append("business_type = ?")
+            params.append(request.args["business_type"])
+        limit = int(request.args.get("limit", -1))  # -1 = no limit in SQLite
+        if limit == 0 or limit < -1:
+            raise ValueError("limit must be positive")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Each branch is a range scan on its (account, datetime) index; the
+    # compound ORDER BY merges them without sorting the whole history.
+    where = "".join(f" AND {f}" for f in filters)
+    columns = select_list(fields, required=("datetime", "id"))
+    rows = conn.execute(f"""
+        SELECT {columns} FROM (
+            SELECT *, 'IN' AS direction, amount AS net_amount FROM Transactions
+            WHERE destination_account = ?{where}
+        )
+        UNION ALL
+        SELECT {columns} FROM (
+            SELECT *, 'OUT' AS direction, -amount AS net_amount FROM Transactions
+            WHERE origin_account = ?{where}
+        )
+        ORDER BY datetime DESC, id DESC
+        LIMIT ?
+    """, (account_id, *params, account_id, *params, limit)).fetchall()
+    return jsonify(serialize(rows, fields, fmt))
 
 @transactions_bp.route('/<int:transaction_id>', methods=['GET'])
 def get_transaction(transaction_id):
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.row_factory = sqlite3.Row
-        row = conn.execute("SELECT * FROM Transactions WHERE id = ?", (transaction_id,)).fetchone()
+    conn = get_db()
+    row = conn.execute("SELECT * FROM Transactions WHERE id = ?", (transaction_id,)).fetchone()
     if not row:
         return jsonify({"error": "Transaction not found"}), 404
     return jsonify(dict(row))
@@ -45,45 +192,191 @@ def add_transaction():
     origin = data.get("origin_account")
     dest = data.get("destination_account")
     amount = data.get("amount")
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("PRAGMA journal_mode=WAL;")
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO Transactions (origin_account, destination_account, amount, datetime)
-            VALUES (?, ?, ?, ?)
-        """, (origin, dest, amount, datetime.now().isoformat()))
-        conn.commit()
-    if origin:
-        update_balance(origin, -amount)
-    if dest:
-        update_balance(dest, amount)
+    category = data.get("business_type") or "PERSONAL TRANSFER"
+
+    def write(conn):
+        when = datetime.now().strftime(DATETIME_FORMAT)
+        conn.execute("""
+            INSERT INTO Transactions (origin_account, destination_account, amount, datetime, business_type)
+            VALUES (?, ?, ?, ?, ?)
+        """, (origin, dest, amount, when, category))
+        if origin:
+            record_spending(conn, origin, when, category, amount)
+            apply_flow(conn, origin, when, outflow=amount)
+        if dest:
+            apply_flow(conn, dest, when, inflow=amount)
+
+    try:
+        run_write(write)
+    except sqlite3.IntegrityError as e:
+        return jsonify({"error": str(e)}), 400
+    publish_balances(get_db(), origin, dest)
     return jsonify({"message": "Transaction added"}), 201
 
+def parse_batch_body():
+    """
+    Returns the batch as a list of items: a JSON array, or one JSON object
+    per line for NDJSON bodies. Lines that fail to parse are kept as
+    exceptions so they get their own error result.
+    """
+    if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        items = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                items.append(ValueError(f"Invalid JSON: {e}"))
+        return items
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        raise ValueError("Body must be a JSON array or NDJSON")
+    return data
+
+def validate_batch_item(item):
+    """Returns the Transactions row tuple for `item`, or raises ValueError."""
+    if isinstance(item, Exception):
+        raise item
+    if not isinstance(item, dict):
+        raise ValueError("Item must be an object")
+    origin = item.get("origin_account")
+    dest = item.get("destination_account")
+    amount = item.get("amount")
+    for name, acc in (("origin_account", origin), ("destination_account", dest)):
+        if acc is not None and (not isinstance(acc, int) or isinstance(acc, bool)):
+            raise ValueError(f"{name} must be an integer")
+    if origin is None and dest is None:
+        raise ValueError("origin_account or destination_account is required")
+    if not isinstance(amount, (int, float)) or isinstance(amount, bool) or not math.isfinite(amount) or amount < 0:
+        raise ValueError("amount must be a non-negative number")
+    try:
+        when = datetime.fromisoformat(item["datetime"]) if item.get("datetime") else datetime.now()
+    except (TypeError, ValueError):
+        raise ValueError("datetime must be an ISO 8601 string")
+    if when.tzinfo is not None:
+        when = when.astimezone().replace(tzinfo=None)
+    when = when.strftime(DATETIME_FORMAT)
+    return (origin, dest, amount, when, item.get("business_type") or "PERSONAL TRANSFER")
+
+@transactions_bp.route('/batch', methods=['POST'])
+def add_transactions_batch():
+    """
+    Inserts many transactions in one write transaction.
+    Rows are validated up front; invalid rows are reported and skipped while
+    the rest are inserted with chunked executemany(). Balances get one
+    aggregated UPDATE per touched account.
+    """
+    try:
+        items = parse_batch_body()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if len(items) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"At most {MAX_BATCH_SIZE} transactions per batch"}), 413
+
+    results = [None] * len(items)
+    valid = []  # (index, row)
+    for i, item in enumerate(items):
+        try:
+            valid.append((i, validate_batch_item(item)))
+        except ValueError as e:
+            results[i] = {"index": i, "status": "error", "error": str(e)}
+
+    conn = get_db()
+    referenced = {acc for _, row in valid for acc in row[:2] if acc is not None}
+    existing = {r[0] for r in conn.execute(
+        "SELECT id FROM Accounts WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps(sorted(referenced)),)
+    )}
+    rows, deltas, flows, spendings = [], {}, {}, {}
+    for i, row in valid:
+        missing = [acc for acc in row[:2] if acc is not None and acc not in existing]
+        if missing:
+            results[i] = {"index": i, "status": "error", "error": f"Account {missing[0]} not found"}
+            continue
+        rows.append((i, row))
+        origin, dest, amount, when, category = row
+        day = when[:10]
+        if origin is not None:
+            deltas[origin] = deltas.get(origin, 0.0) - amount
+            flows.setdefault((origin, day), [0.0, 0.0])[1] += amount
+            spent = spendings.setdefault((origin, day, category), [0.0, 0])
+            spent[0] += amount
+            spent[1] += 1
+        if dest is not None:
+            deltas[dest] = deltas.get(dest, 0.0) + amount
+            flows.setdefault((dest, day), [0.0, 0.0])[0] += amount
+
+    def write(conn):
+        # AUTOINCREMENT ids are handed out sequentially while we hold the
+        # write lock, so the new ids follow the current high-water mark.
+        last_id = conn.execute("""
+            SELECT MAX(IFNULL((SELECT seq FROM sqlite_sequence WHERE name = 'Transactions'), 0),
+                       IFNULL((SELECT MAX(id) FROM Transactions), 0))
+        """).fetchone()[0]
+        for start in range(0, len(rows), BATCH_CHUNK_SIZE):
+            conn.executemany("""
+                INSERT INTO Transactions (origin_account, destination_account, amount, datetime, business_type)
+                VALUES (?, ?, ?, ?, ?)
+            """, [row for _, row in rows[start:start + BATCH_CHUNK_SIZE]])
+        record_flows(conn, [(acc, day, inflow, outflow) for (acc, day), (inflow, outflow) in flows.items()])
+        record_spendings(conn, [(*key, amount, count) for key, (amount, count) in spendings.items()])
+        conn.executemany(
+            "UPDATE Accounts SET balance = balance + ? WHERE id = ?",
+            [(delta, acc) for acc, delta in deltas.items()]
+        )
+        return last_id
+
+    if rows:
+        try:
+            last_id = run_write(write)
+        except sqlite3.IntegrityError as e:
+            # An account went away since the check above; nothing was inserted
+            return jsonify({"error": str(e)}), 409
+        for n, (i, _) in enumerate(rows, start=1):
+            results[i] = {"index": i, "status": "created", "id": last_id + n}
+        publish_balances(conn, *deltas)
+
+    body = {"created": len(rows), "failed": len(items) - len(rows), "results": results}
+    return jsonify(body), 201 if rows else 400
+
 @transactions_bp.route('/<int:transaction_id>', methods=['PATCH'])
 def update_transaction(transaction_id):
     data = request.get_json()
-    with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        if 'amount' in data:
-            cur.execute("SELECT origin_account, destination_account, amount FROM Transactions WHERE id = ?", (transaction_id,))
-            old = cur.fetchone()
-            if old:
-                diff = data['amount'] - old[2]
-                if old[0]: update_balance(old[0], -diff)
-                if old[1]: update_balance(old[1], diff)
-            cur.execute("UPDATE Transactions SET amount = ? WHERE id = ?", (data['amount'], transaction_id))
-            conn.commit()
+
+    def write(conn):
+        old = conn.execute("SELECT origin_account, destination_account, amount, datetime, business_type FROM Transactions WHERE id = ?", (transaction_id,)).fetchone()
+        if old:
+            diff = data['amount'] - old[2]
+            if old[0]:
+                record_spending(conn, old[0], old[3], old[4], diff, transactions=0)
+                apply_flow(conn, old[0], old[3], outflow=diff)
+            if old[1]: apply_flow(conn, old[1], old[3], inflow=diff)
+        conn.execute("UPDATE Transactions SET amount = ? WHERE id = ?", (data['amount'], transaction_id))
+        return old
+
+    if 'amount' in data:
+        try:
+            old = run_write(write)
+        except sqlite3.IntegrityError as e:
+            return jsonify({"error": str(e)}), 400
+        if old:
+            publish_balances(get_db(), old[0], old[1])
     return jsonify({"message": "Transaction updated"})
 
 @transactions_bp.route('/<int:transaction_id>', methods=['DELETE'])
 def delete_transaction(transaction_id):
-    with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT origin_account, destination_account, amount FROM Transactions WHERE id = ?", (transaction_id,))
-        t = cur.fetchone()
+    def write(conn):
+        t = conn.execute("SELECT origin_account, destination_account, amount, datetime, business_type FROM Transactions WHERE id = ?", (transaction_id,)).fetchone()
         if t:
-            if t[0]: update_balance(t[0], t[2])
-            if t[1]: update_balance(t[1], -t[2])
-        cur.execute("DELETE FROM Transactions WHERE id = ?", (transaction_id,))
-        conn.commit()
+            if t[0]:
+                record_spending(conn, t[0], t[3], t[4], -t[2], transactions=-1)
+                apply_flow(conn, t[0], t[3], outflow=-t[2])
+            if t[1]: apply_flow(conn, t[1], t[3], inflow=-t[2])
+        conn.execute("DELETE FROM Transactions WHERE id = ?", (transaction_id,))
+        return t
+
+    t = run_write(write)
+    if t:
+        publish_balances(get_db(), t[0], t[1])
     return jsonify({"message": "Transaction deleted"})
@@ -0,0 +1,457 @@
+"""
+In-process endpoint benchmark.
+
+Builds a database with the synthetic data generator, then drives every
+blueprint through Flask's test client from several threads with a mixed
+read/write workload. Reports throughput and p50/p95/p99 latency per route as
+JSON, so runs can be compared across commits.
+
+Run from the repository root:
+
+    python tests/benchmark.py --accounts 200 --requests 5000 --threads 8 -o bench.json
+    python tests/benchmark.py --db /tmp/bench.db --baseline bench.json
+    python tests/benchmark.py --write-queue -o queue.json --baseline bench.json
+"""
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app import app
+from db.connection import get_db
+from db.create import create_db
+from db.populate import populate_db
+
+# (weight, operation) – reads dominate, as in the app's real traffic
+WORKLOAD = [
+    (10, "list_accounts"),
+    (15, "get_account"),
+    (8, "account_history"),
+    (4, "account_spending"),
+    (8, "transactions_page"),
+    (12, "account_transactions"),
+    (3, "get_transaction"),
+    (8, "add_transaction"),
+    (1, "add_transaction_batch"),
+    (2, "update_transaction"),
+    (1, "delete_transaction"),
+    (4, "list_goals"),
+    (5, "account_goals"),
+    (3, "add_goal"),
+    (2, "update_goal"),
+    (1, "delete_goal"),
+    (3, "goal_transactions"),
+    (3, "add_goal_transaction"),
+    (1, "update_goal_transaction"),
+    (1, "delete_goal_transaction"),
+    (3, "list_missions"),
+    (2, "add_mission"),
+    (1, "update_mission"),
+    (1, "delete_mission"),
+    (1, "evaluate_missions"),
+    (1, "generate_missions"),
+    (10, "forecast"),
+    (2, "forecast_batch"),
+    (1, "update_account"),
+    (1, "delete_account"),
+]
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+class Workload:
+    """Picks requests at random and remembers the ids created along the way."""
+
+    def __init__(self, account_ids, transaction_ids, seed):
+        self.account_ids = account_ids
+        # Deletes get ids of their own, so no read or update ever races one
+        half = len(transaction_ids) // 2
+        self.transaction_ids = transaction_ids[:half]
+        self.deletable_ids = transaction_ids[half:]
+        # Filled in by main(); the deletable_* lists are only ever deleted
+        self.deletable_account_ids = []
+        self.goal_ids = []
+        self.deletable_goal_ids = []
+        self.goal_transaction_ids = []
+        self.deletable_goal_transaction_ids = []
+        self.mission_ids = []
+        self.deletable_mission_ids = []
+        self.lock = threading.Lock()
+        self.seed = seed
+        self.names, weights = zip(*((name, weight) for weight, name in WORKLOAD))
+        self.weights = weights
+
+    def requests(self, count, thread):
+        rng = random.Random(f"{self.seed}:{thread}")
+        for name in rng.choices(self.names, self.weights, k=count):
+            yield getattr(self, name)(rng)
+
+    def account(self, rng):
+        return rng.choice(self.account_ids)
+
+    def day(self, rng):
+        return (datetime(2025, 10, 1) - timedelta(days=rng.randrange(365))).strftime("%Y-%m-%d")
+
+    def pick(self, rng, ids):
+        with self.lock:
+            return rng.choice(ids) if ids else None
+
+    def take(self, rng, ids):
+        """Removes and returns a random id, so each one is deleted once."""
+        with self.lock:
+            return ids.pop(rng.randrange(len(ids))) if ids else None
+
+    # --- accounts ---
+    def list_accounts(self, rng):
+        return "GET", "/accounts/", {"query_string": {"fields": "id,balance"}}
+
+    def get_account(self, rng):
+        return "GET", f"/accounts/{self.account(rng)}", {}
+
+    def account_history(self, rng):
+        return "GET", f"/accounts/{self.account(rng)}/history", {"query_string": {"from": self.day(rng)}}
+
+    def account_spending(self, rng):
+        return "GET", f"/accounts/{self.account(rng)}/spending", {"query_string": {"group": rng.choice(("month", "week"))}}
+
+    def update_account(self, rng):
+        return "PATCH", f"/accounts/{self.account(rng)}", {"json": {"last_name": f"Bench{rng.randrange(1000)}"}}
+
+    def delete_account(self, rng):
+        account_id = self.take(rng, self.deletable_account_ids)
+        if account_id is None:
+            return self.get_account(rng)
+        return "DELETE", f"/accounts/{account_id}", {}
+
+    # --- transactions ---
+    def transactions_page(self, rng):
+        return "GET", "/transactions/", {"query_string": {"limit": 100}}
+
+    def account_transactions(self, rng):
+        return "GET", f"/transactions/account/{self.account(rng)}", {"query_string": {"limit": 50}}
+
+    def get_transaction(self, rng):
+        return "GET", f"/transactions/{self.pick(rng, self.transaction_ids)}", {}
+
+    def add_transaction(self, rng):
+        return "POST", "/transactions/", {"json": {
+            "origin_account": self.account(rng),
+            "destination_account": self.account(rng),
+            "amount": round(rng.uniform(1, 100), 2),
+            "business_type": "TRANSFER",
+        }}
+
+    def add_transaction_batch(self, rng):
+        return "POST", "/transactions/batch", {"json": [
+            {"origin_account": self.account(rng), "amount": round(rng.uniform(1, 50), 2), "business_type": "COFFEE"}
+            for _ in range(100)
+        ]}
+
+    def update_transaction(self, rng):
+        # Only the amount is updatable; it moves balances and rollups
+        return "PATCH", f"/transactions/{self.pick(rng, self.transaction_ids)}", {"json": {
+            "amount": round(rng.uniform(1, 100), 2),
+        }}
+
+    def delete_transaction(self, rng):
+        tid = self.take(rng, self.deletable_ids)
+        if tid is None:
+            return self.get_transaction(rng)
+        return "DELETE", f"/transactions/{tid}", {}
+
+    # --- goals ---
+    def list_goals(self, rng):
+        return "GET", "/goals/", {}
+
+    def account_goals(self, rng):
+        return "GET", f"/goals/account/{self.account(rng)}", {}
+
+    def add_goal(self, rng):
+        return "POST", "/goals/", {"json": {
+            "UserId": self.account(rng),
+            "GoalName": "Benchmark goal",
+            "TargetAmount": rng.randrange(500, 5000),
+            "Deadline": "2026-06-01",
+        }}
+
+    def update_goal(self, rng):
+        goal_id = self.pick(rng, self.goal_ids)
+        if goal_id is None:
+            return self.add_goal(rng)
+        return "PATCH", f"/goals/{goal_id}", {"json": {"CurrentAmount": rng.randrange(0, 500)}}
+
+    def delete_goal(self, rng):
+        goal_id = self.take(rng, self.deletable_goal_ids)
+        if goal_id is None:
+            return self.list_goals(rng)
+        return "DELETE", f"/goals/{goal_id}", {}
+
+    # --- goal transactions ---
+    def goal_transactions(self, rng):
+        return "GET", f"/goal-transactions/goal/{self.pick(rng, self.goal_ids)}", {}
+
+    def add_goal_transaction(self, rng):
+        return "POST", "/goal-transactions/", {"json": {
+            "GoalId": self.pick(rng, self.goal_ids),
+            "Type": rng.choice(("IN", "IN", "OUT")),
+            "Amount": round(rng.uniform(1, 50), 2),
+        }}
+
+    def update_goal_transaction(self, rng):
+        return "PATCH", f"/goal-transactions/{self.pick(rng, self.goal_transaction_ids)}", {"json": {
+            "Amount": round(rng.uniform(1, 50), 2),
+        }}
+
+    def delete_goal_transaction(self, rng):
+        transaction_id = self.take(rng, self.deletable_goal_transaction_ids)
+        if transaction_id is None:
+            return self.goal_transactions(rng)
+        return "DELETE", f"/goal-transactions/{transaction_id}", {}
+
+    # --- missions ---
+    def list_missions(self, rng):
+        return "GET", "/missions/", {}
+
+    def add_mission(self, rng):
+        goal_id = self.pick(rng, self.goal_ids)
+        if goal_id is None:
+            return self.add_goal(rng)
+        return "POST", "/missions/", {"json": {
+            "UserId": self.account(rng),
+            "GoalId": goal_id,
+            "Title": "Benchmark mission",
+            "Type": "SAVE",
+            "TargetAmount": 100,
+            "Deadline": "2026-02-01",
+        }}
+
+    def update_mission(self, rng):
+        mission_id = self.pick(rng, self.mission_ids)
+        if mission_id is None:
+            return self.list_missions(rng)
+        return "PATCH", f"/missions/{mission_id}", {"json": {"IsCompleted": 1}}
+
+    def delete_mission(self, rng):
+        mission_id = self.take(rng, self.deletable_mission_ids)
+        if mission_id is None:
+            return self.list_missions(rng)
+        return "DELETE", f"/missions/{mission_id}", {}
+
+    def evaluate_missions(self, rng):
+        return "POST", "/missions/evaluate", {}
+
+    def generate_missions(self, rng):
+        # Only goals created since the last run get missions for the week
+        return "POST", "/missions/generate", {}
+
+    # --- forecast ---
+    def forecast(self, rng):
+        return "GET", f"/forecast/{self.account(rng)}", {"query_string": {"days": rng.choice((30, 90, 365))}}
+
+    def forecast_batch(self, rng):
+        return "POST", "/forecast/batch", {"json": {
+            "account_ids": rng.sample(self.account_ids, min(20, len(self.account_ids))),
+            "days": rng.choice((30, 90)),
+            "cd_apy": [0.02, 0.035, 0.05],
+            "ai_delta": [0.0, 0.1],
+        }}
+
+def route_label(adapter, method, path):
+    """The URL rule a request is routed to, e.g. 'GET /accounts/<int:account_id>'."""
+    try:
+        rule, _ = adapter.match(path, method=method, return_rule=True)
+        return f"{method} {rule.rule}"
+    except Exception:
+        return f"{method} {path}"
+
+def run(workload, requests_per_thread, threads):
+    adapter = app.url_map.bind("localhost")
+    samples = {}
+    errors = {}
+    samples_lock = threading.Lock()
+
+    def worker(thread):
+        client = app.test_client()
+        local, failed = {}, {}
+        for method, path, kwargs in workload.requests(requests_per_thread, thread):
+            label = route_label(adapter, method, path)
+            start = time.perf_counter()
+            response = client.open(path, method=method, **kwargs)
+            elapsed = time.perf_counter() - start
+            local.setdefault(label, []).append(elapsed)
+            if response.status_code >= 400:
+                failed[label] = failed.get(label, 0) + 1
+            response.close()
+        with samples_lock:
+            for label, values in local.items():
+                samples.setdefault(label, []).extend(values)
+            for label, count in failed.items():
+                errors[label] = errors.get(label, 0) + count
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(worker, range(threads)))
+    return samples, errors, time.perf_counter() - started
+
+def summarize(samples, errors, wall):
+    routes = {}
+    for label in sorted(samples):
+        values = sorted(samples[label])
+        routes[label] = {
+            "requests": len(values),
+            "errors": errors.get(label, 0),
+            "throughput_rps": round(len(values) / wall, 1),
+            "mean_ms": round(sum(values) / len(values) * 1000, 3),
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+        }
+    total = sum(len(v) for v in samples.values())
+    everything = sorted(v for values in samples.values() for v in values)
+    overall = {
+        "requests": total,
+        "errors": sum(errors.values()),
+        "throughput_rps": round(total / wall, 1),
+        "p50_ms": round(percentile(everything, 50) * 1000, 3),
+        "p95_ms": round(percentile(everything, 95) * 1000, 3),
+        "p99_ms": round(percentile(everything, 99) * 1000, 3),
+    }
+    return routes, overall
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(report, baseline):
+    """Prints p95 and throughput changes against a previous report."""
+    print(f"\n{'route':<48} {'p95 ms':>18} {'req/s':>18}")
+    for label, stats in report["routes"].items():
+        old = baseline["routes"].get(label)
+        if not old:
+            print(f"{label:<48} {stats['p95_ms']:>18} {stats['throughput_rps']:>18}  (new)")
+            continue
+        p95 = f"{old['p95_ms']} -> {stats['p95_ms']}"
+        rps = f"{old['throughput_rps']} -> {stats['throughput_rps']}"
+        print(f"{label:<48} {p95:>18} {rps:>18}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the GoalFlow endpoints in-process.")
+    parser.add_argument("--db", help="database to use (default: a fresh temporary one)")
+    parser.add_argument("--accounts", type=int, default=100, help="accounts to generate")
+    parser.add_argument("--days", type=int, default=365, help="days of transactions to generate")
+    parser.add_argument("--requests", type=int, default=2000, help="total requests")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("-o", "--output", help="write the JSON report here (default: stdout)")
+    parser.add_argument("--baseline", help="previous JSON report to compare against")
+    parser.add_argument("--write-queue", action="store_true", help="hand writes to the group-committing writer thread")
+    args = parser.parse_args()
+
+    tmpdir = None
+    db_path = args.db
+    if db_path is None or not os.path.exists(db_path):
+        if db_path is None:
+            tmpdir = tempfile.TemporaryDirectory()
+            db_path = os.path.join(tmpdir.name, "bench.db")
+        end = datetime(2025, 10, 1)
+        print(f"Generating {args.accounts} accounts into {db_path}...", file=sys.stderr)
+        create_db(db_path)
+        populate_db(db_path, args.accounts, end - timedelta(days=args.days), end, args.seed,
+                    workers=os.cpu_count() or 1)
+
+    app.config["DATABASE"] = db_path
+    app.config["TESTING"] = True
+    app.config["WRITE_QUEUE"] = args.write_queue
+    with app.app_context():
+        conn = get_db()
+        account_ids = [r[0] for r in conn.execute("SELECT id FROM Accounts")]
+        transaction_ids = [r[0] for r in conn.execute("SELECT id FROM Transactions ORDER BY id DESC LIMIT 10000")]
+        counts = {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+                  for t in ("Accounts", "Transactions", "Goals", "WeeklyMissions")}
+
+    workload = Workload(account_ids, transaction_ids, args.seed)
+    # Seed goals, goal transactions and missions so the update and delete
+    # paths have targets, and empty accounts for the account deletes
+    with app.app_context():
+        conn = get_db()
+        with conn:
+            def insert(sql, params):
+                return conn.execute(sql, params).lastrowid
+
+            for account_id in account_ids[:20]:
+                for ids in (workload.goal_ids, workload.deletable_goal_ids):
+                    ids.append(insert(
+                        "INSERT INTO Goals (UserId, GoalName, TargetAmount, Deadline) VALUES (?, 'Benchmark goal', 1000, '2026-06-01')",
+                        (account_id,)
+                    ))
+                goal_id = workload.goal_ids[-1]
+                for ids in (workload.goal_transaction_ids, workload.deletable_goal_transaction_ids):
+                    ids.append(insert(
+                        "INSERT INTO GoalTransactions (GoalId, UserId, Type, Amount) VALUES (?, ?, 'IN', 50)",
+                        (goal_id, account_id)
+                    ))
+                for ids in (workload.mission_ids, workload.deletable_mission_ids):
+                    ids.append(insert(
+                        "INSERT INTO WeeklyMissions (UserId, GoalId, Title, Type, TargetAmount, Deadline) VALUES (?, ?, 'Benchmark mission', 'SAVE', 100, '2026-02-01')",
+                        (account_id, goal_id)
+                    ))
+            for n in range(50):
+                workload.deletable_account_ids.append(insert(
+                    "INSERT INTO Accounts (first_name, last_name, email) VALUES ('Bench', 'Delete', ?)",
+                    (f"bench-delete-{n}@example.com",)
+                ))
+
+    per_thread = max(1, args.requests // args.threads)
+    print(f"Running {per_thread * args.threads} requests on {args.threads} threads...", file=sys.stderr)
+    samples, errors, wall = run(workload, per_thread, args.threads)
+    routes, overall = summarize(samples, errors, wall)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "accounts": counts["Accounts"],
+            "transactions": counts["Transactions"],
+            "requests": per_thread * args.threads,
+            "threads": args.threads,
+            "seed": args.seed,
+            "write_queue": args.write_queue,
+        },
+        "wall_seconds": round(wall, 3),
+        "overall": overall,
+        "routes": routes,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+        print(f"Report written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    if args.baseline:
+        compare(report, json.loads(Path(args.baseline).read_text()))
+
+    if tmpdir is not None:
+        tmpdir.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,35 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+import json
+import os
+import sys
+import tempfile
 import unittest
 import requests
 import random
 import time
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app import app
+from db.create import create_db
+from db.populate import populate_db
+from routes import events
+
 BASE = "http://127.0.0.1:5000"
 
 
+def read_events(response):
+    """(event, data) pairs of a streamed text/event-stream response, as they arrive."""
+    event = None
+    for line in response.iter_lines(chunk_size=1, decode_unicode=True):
+        if line.startswith("event: "):
+            event = line[7:]
+        elif line.startswith("data: "):
+            yield event, json.loads(line[6:])
+
+
 class TestAPI(unittest.TestCase):
 
     @classmethod
@@ -33,10 +57,31 @@ class TestAPI(unittest.TestCase):
 
         r = requests.get(f"{BASE}/accounts/{account_id}")
         self.assertEqual(r.status_code, 200)
+        etag = r.headers["ETag"]
+
+        r = requests.get(f"{BASE}/accounts/{account_id}", headers={"If-None-Match": etag})
+        self.assertEqual(r.status_code, 304)
+
+        r = requests.get(f"{BASE}/accounts/{account_id}/history")
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json(), [])
+
+        # The opening balance and balance edits are ledger entries, not drift
+        r = requests.get(f"{BASE}/accounts/reconcile")
+        self.assertEqual(r.status_code, 200)
+        self.assertNotIn(account_id, [a["account_id"] for a in r.json()["accounts"]])
 
         r = requests.patch(f"{BASE}/accounts/{account_id}", json={"balance": 1200})
         self.assertEqual(r.status_code, 200)
 
+        r = requests.get(f"{BASE}/accounts/reconcile")
+        self.assertNotIn(account_id, [a["account_id"] for a in r.json()["accounts"]])
+        self.assertEqual(requests.post(f"{BASE}/accounts/reconcile").status_code, 405)
+
+        r = requests.get(f"{BASE}/accounts/{account_id}", headers={"If-None-Match": etag})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json()["balance"], 1200)
+
         r = requests.delete(f"{BASE}/accounts/{account_id}")
         self.assertEqual(r.status_code, 200)
 
@@ -63,12 +108,32 @@ class TestAPI(unittest.TestCase):
         accs = requests.get(f"{BASE}/accounts/").json()
         id1, id2 = accs[-2]['id'], accs[-1]['id']
 
+        # Balance changes are pushed to the account's event stream
+        stream = requests.get(f"{BASE}/accounts/{id2}/events", stream=True, timeout=5)
+        received = read_events(stream)
+        self.assertEqual(next(received), ("balance", {"account_id": id2, "balance": 500}))
+
         r = requests.post(f"{BASE}/transactions/", json={
             "origin_account": id1,
             "destination_account": id2,
             "amount": 150
         })
         self.assertEqual(r.status_code, 201)
+        self.assertEqual(next(received), ("balance", {"account_id": id2, "balance": 650}))
+        stream.close()
+
+        # Stored in the ledger's datetime format, like batch rows
+        stored = requests.get(f"{BASE}/transactions/account/{id2}").json()
+        self.assertRegex(stored[0]["datetime"], r"^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d$")
+
+        # The daily rollup follows the transfer
+        history = requests.get(f"{BASE}/accounts/{id2}/history").json()
+        self.assertAlmostEqual(history[-1]["inflow"], 150)
+        self.assertAlmostEqual(history[-1]["closing_balance"], 650)
+
+        # ... and so does the sender's spending (default category)
+        spending = requests.get(f"{BASE}/accounts/{id1}/spending", params={"group": "week"}).json()
+        self.assertAlmostEqual(spending["periods"][-1]["categories"]["PERSONAL TRANSFER"], 150)
 
         r = requests.get(f"{BASE}/transactions/")
         self.assertEqual(r.status_code, 200)
@@ -76,17 +141,121 @@ class TestAPI(unittest.TestCase):
         self.assertTrue(len(transactions) > 0)
         tid = transactions[0]['id']
 
+        # Keyset pagination
+        r = requests.get(f"{BASE}/transactions/", params={"limit": 1})
+        self.assertEqual(r.status_code, 200)
+        page = r.json()
+        self.assertEqual(page["transactions"][0]["id"], tid)
+        if page["next_cursor"]:
+            r = requests.get(f"{BASE}/transactions/", params={"limit": 1, "after": page["next_cursor"]})
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.json()["transactions"][0]["id"], transactions[1]["id"])
+
         r = requests.patch(f"{BASE}/transactions/{tid}", json={"amount": 200})
         self.assertEqual(r.status_code, 200)
 
         r = requests.delete(f"{BASE}/transactions/{tid}")
         self.assertEqual(r.status_code, 200)
 
+    def test_transactions_batch(self):
+        accs = requests.get(f"{BASE}/accounts/").json()
+        id1, id2 = accs[0]['id'], accs[1]['id']
+        before = {a['id']: a['balance'] for a in accs}
+
+        r = requests.post(f"{BASE}/transactions/batch", json=[
+            {"origin_account": id1, "destination_account": id2, "amount": 10},
+            {"origin_account": id1, "amount": 5, "business_type": "COFFEE"},
+            {"origin_account": id1, "amount": -1},
+        ])
+        self.assertEqual(r.status_code, 201, r.text)
+        body = r.json()
+        self.assertEqual(body["created"], 2)
+        self.assertEqual(body["results"][2]["status"], "error")
+
+        after = {a['id']: a['balance'] for a in requests.get(f"{BASE}/accounts/").json()}
+        self.assertAlmostEqual(after[id1] - before[id1], -15)
+        self.assertAlmostEqual(after[id2] - before[id2], 10)
+
+        for result in body["results"][:2]:
+            r = requests.delete(f"{BASE}/transactions/{result['id']}")
+            self.assertEqual(r.status_code, 200)
+
+        # NaN / Infinity are valid NDJSON to Python but not amounts
+        r = requests.post(f"{BASE}/transactions/batch", headers={"Content-Type": "application/x-ndjson"},
+                          data=f'{{"origin_account": {id1}, "amount": NaN}}\n')
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(r.json()["results"][0]["status"], "error")
+
+        # Any ISO 8601 form is stored in the ledger's own format
+        r = requests.post(f"{BASE}/transactions/batch", json=[
+            {"origin_account": id1, "destination_account": id2, "amount": 1, "datetime": "20251025"},
+        ])
+        self.assertEqual(r.status_code, 201, r.text)
+        tid = r.json()["results"][0]["id"]
+        self.assertEqual(requests.get(f"{BASE}/transactions/{tid}").json()["datetime"], "2025-10-25 00:00:00")
+        self.assertEqual(requests.delete(f"{BASE}/transactions/{tid}").status_code, 200)
+
+    def test_concurrent_writes(self):
+        # Concurrent writes (grouped into shared commits when the server runs
+        # with FLASK_WRITE_QUEUE=true): a failing one leaves the others alone
+        accs = requests.get(f"{BASE}/accounts/").json()
+        id1, id2 = accs[0]['id'], accs[1]['id']
+        before = {i: requests.get(f"{BASE}/accounts/{i}").json()["balance"] for i in (id1, id2)}
+
+        destinations = [id2] * 15 + [999999] + [id2] * 4
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            statuses = list(pool.map(lambda dest: requests.post(f"{BASE}/transactions/", json={
+                "origin_account": id1, "destination_account": dest, "amount": 10
+            }).status_code, destinations))
+        self.assertEqual(statuses.count(201), 19)
+        self.assertEqual(statuses[15], 400)
+
+        after = {i: requests.get(f"{BASE}/accounts/{i}").json()["balance"] for i in (id1, id2)}
+        self.assertAlmostEqual(after[id1], before[id1] - 190)
+        self.assertAlmostEqual(after[id2], before[id2] + 190)
+
+    # --- FORECASTS ---
+    def test_forecast_batch(self):
+        source = requests.get(f"{BASE}/accounts/").json()[0]['id']
+        r = requests.post(f"{BASE}/accounts/", json={
+            "first_name": "Forecast",
+            "last_name": "F",
+            "phone_number": f"55{random.randint(10000,99999)}",
+            "email": f"f{random.randint(100,999)}@example.com",
+            "balance": 100
+        })
+        self.assertEqual(r.status_code, 201)
+        account_id = requests.get(f"{BASE}/accounts/").json()[-1]['id']
+
+        # The last day's only transaction is deleted again, leaving a zero
+        # row in the daily rollup
+        r = requests.post(f"{BASE}/transactions/batch", json=[
+            {"origin_account": source, "destination_account": account_id, "amount": amount, "datetime": when}
+            for amount, when in ((120, "2025-01-01T09:00:00"), (80, "2025-01-05T09:00:00"), (40, "2025-01-20T09:00:00"))
+        ])
+        self.assertEqual(r.status_code, 201, r.text)
+        r = requests.delete(f"{BASE}/transactions/{r.json()['results'][-1]['id']}")
+        self.assertEqual(r.status_code, 200)
+
+        # The batch baseline matches the single-account one
+        single = requests.get(f"{BASE}/forecast/{account_id}", params={"days": 3, "cd_apy": 0.05, "ai_delta": 0.2}).json()
+        r = requests.post(f"{BASE}/forecast/batch", json={"account_ids": [account_id], "days": 3, "cd_apy": 0.05, "ai_delta": 0.2})
+        self.assertEqual(r.status_code, 200, r.text)
+        batch = r.json()
+        self.assertEqual(batch["avg_daily_net"][0], single["baseline"]["avg_daily_net"])
+        self.assertEqual(batch["balances"][0][0][0], single["scenarios"]["combined"])
+
+        r = requests.delete(f"{BASE}/accounts/{account_id}")
+        self.assertEqual(r.status_code, 200)
+
     # --- GOALS ---
     def test_goals(self):
         # Get an existing account ID
         accounts = requests.get(f"{BASE}/accounts/").json()
         acc_id = accounts[0]['id']
+        stream = requests.get(f"{BASE}/accounts/{acc_id}/events", stream=True, timeout=5)
+        received = read_events(stream)
+        self.assertEqual(next(received)[0], "balance")
 
         # Create a new goal (includes new Category field)
         r = requests.post(f"{BASE}/goals/", json={
@@ -100,6 +269,9 @@ class TestAPI(unittest.TestCase):
         })
         self.assertEqual(r.status_code, 201, f"Goal creation failed: {r.text}")
 
+        r = requests.post(f"{BASE}/goals/", json={"UserId": 999999, "GoalName": "Nobody's", "TargetAmount": 10})
+        self.assertEqual(r.status_code, 400)
+
         # Get all goals
         r = requests.get(f"{BASE}/goals/")
         self.assertEqual(r.status_code, 200, f"Fetching all goals failed: {r.text}")
@@ -107,16 +279,52 @@ class TestAPI(unittest.TestCase):
         self.assertTrue(len(goals) > 0)
         goal_id = goals[-1]['GoalId']
 
+        # ... and it is pushed to the account's event stream
+        event, goal = next(received)
+        self.assertEqual(event, "goal")
+        self.assertEqual((goal["GoalId"], goal["GoalName"], goal["CurrentAmount"]), (goal_id, "Save for laptop", 300))
+        stream.close()
+
         # Get all goals for the specific account (new endpoint)
         r = requests.get(f"{BASE}/goals/account/{acc_id}")
         self.assertEqual(r.status_code, 200, f"Fetching goals by account failed: {r.text}")
         acc_goals = r.json()
         self.assertTrue(any(g['UserId'] == acc_id for g in acc_goals), "No goals found for this account")
 
+        contributions = requests.get(f"{BASE}/goals/{goal_id}").json()["ContributionCount"]
+
         # Update goal progress
         r = requests.patch(f"{BASE}/goals/{goal_id}", json={"CurrentAmount": 500})
         self.assertEqual(r.status_code, 200, f"Goal update failed: {r.text}")
 
+        # Contributions move the goal's progress
+        r = requests.post(f"{BASE}/goal-transactions/", json={
+            "GoalId": goal_id, "Type": "IN", "Amount": 250, "CreatedAt": "2025-01-01 00:00:00"
+        })
+        self.assertEqual(r.status_code, 201, f"Goal transaction failed: {r.text}")
+        contribution_id = r.json()["id"]
+        goal = next(g for g in requests.get(f"{BASE}/goals/account/{acc_id}").json() if g['GoalId'] == goal_id)
+        self.assertEqual(goal["CurrentAmount"], 750)
+        self.assertEqual(goal["ProgressPct"], 50.0)
+        # The opening amount and the manual adjustment are not contributions
+        self.assertEqual(goal["ContributionCount"], contributions + 1)
+        self.assertIsNone(goal["ProjectedCompletionDate"])
+
+        # 250 every 10 days: the remaining 500 take another 20 days
+        r = requests.post(f"{BASE}/goal-transactions/", json={
+            "GoalId": goal_id, "Type": "IN", "Amount": 250, "CreatedAt": "2025-01-11 00:00:00"
+        })
+        self.assertEqual(r.status_code, 201, f"Goal transaction failed: {r.text}")
+        second_id = r.json()["id"]
+        goal = next(g for g in requests.get(f"{BASE}/goals/account/{acc_id}").json() if g['GoalId'] == goal_id)
+        self.assertEqual(goal["ProjectedCompletionDate"], "2025-01-31")
+
+        for transaction_id in (contribution_id, second_id):
+            r = requests.delete(f"{BASE}/goal-transactions/{transaction_id}")
+            self.assertEqual(r.status_code, 200)
+        r = requests.get(f"{BASE}/goals/{goal_id}")
+        self.assertEqual(r.json()["CurrentAmount"], 500)
+
         # Delete goal
         r = requests.delete(f"{BASE}/goals/{goal_id}")
         self.assertEqual(r.status_code, 200, f"Goal deletion failed: {r.text}")
@@ -148,16 +356,93 @@ class TestAPI(unittest.TestCase):
         })
         self.assertEqual(r.status_code, 201)
 
+        r = requests.post(f"{BASE}/missions/", json={
+            "UserId": acc_id, "GoalId": 999999, "Title": "No goal", "Deadline": "2026-02-01"
+        })
+        self.assertEqual(r.status_code, 400)
+
         r = requests.get(f"{BASE}/missions/")
         self.assertEqual(r.status_code, 200)
         mid = r.json()[-1]['MissionId']
 
+        r = requests.post(f"{BASE}/missions/evaluate")
+        self.assertEqual(r.status_code, 200)
+        self.assertIn("SAVE", r.json()["completed"])
+
+        r = requests.post(f"{BASE}/missions/generate", params={"week": "2025-12-03"})
+        self.assertIn(r.status_code, (200, 201))
+        self.assertEqual(r.json()["week"], "2025-12-01")
+        r = requests.post(f"{BASE}/missions/generate", params={"week": "2025-12-03"})
+        self.assertEqual(r.json()["created"], 0)
+
+        stream = requests.get(f"{BASE}/accounts/{acc_id}/events", stream=True, timeout=5)
+        received = read_events(stream)
+        self.assertEqual(next(received)[0], "balance")
         r = requests.patch(f"{BASE}/missions/{mid}", json={"IsCompleted": 1})
         self.assertEqual(r.status_code, 200)
+        event, mission = next(received)
+        self.assertEqual((event, mission["MissionId"], mission["IsCompleted"]), ("mission", mid, 1))
+        stream.close()
 
         r = requests.delete(f"{BASE}/missions/{mid}")
         self.assertEqual(r.status_code, 200)
 
 
+class TestEventBus(unittest.TestCase):
+    """The event bus and stream lifecycle, in-process (no server needed)."""
+
+    @classmethod
+    def setUpClass(cls):
+        # A small database of its own, so the sample one is never touched
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(cls.tmpdir.name, "events.db")
+        create_db(db_path)
+        populate_db(db_path, accounts=3, start=datetime(2025, 9, 1), end=datetime(2025, 10, 1))
+        cls.database = app.config["DATABASE"]
+        app.config["DATABASE"] = db_path
+
+    @classmethod
+    def tearDownClass(cls):
+        app.config["DATABASE"] = cls.database
+        cls.tmpdir.cleanup()
+
+    def test_resync(self):
+        # A subscriber that falls SUBSCRIBER_QUEUE_SIZE events behind gets a
+        # single "resync" instead of its backlog
+        subscriber = events.subscribe(-1)
+        try:
+            for n in range(events.SUBSCRIBER_QUEUE_SIZE + 1):
+                events.publish(-1, "balance", {"account_id": -1, "balance": n})
+            self.assertEqual(subscriber.get_nowait(), events.RESYNC)
+            self.assertTrue(subscriber.empty())
+
+            events.publish(-1, "balance", {"account_id": -1, "balance": 0})
+            self.assertIn("event: balance", subscriber.get_nowait())
+        finally:
+            events.unsubscribe(-1, subscriber)
+        self.assertFalse(events.has_subscribers(-1))
+
+    def test_unsubscribe_on_close(self):
+        client = app.test_client()
+        account_id = client.get("/accounts/").get_json()[0]["id"]
+        response = client.get(f"/accounts/{account_id}/events")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("event: balance", next(response.response).decode())
+        self.assertTrue(events.has_subscribers(account_id))
+        response.close()
+        self.assertFalse(events.has_subscribers(account_id))
+
+    def test_stream_limit(self):
+        client = app.test_client()
+        account_id = client.get("/accounts/").get_json()[0]["id"]
+        limit = app.config["MAX_EVENT_STREAMS"]
+        app.config["MAX_EVENT_STREAMS"] = 0
+        try:
+            self.assertEqual(client.get(f"/accounts/{account_id}/events").status_code, 503)
+        finally:
+            app.config["MAX_EVENT_STREAMS"] = limit
+        self.assertFalse(events.has_subscribers(account_id))
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)